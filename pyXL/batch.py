@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+:mod:`batch` -- render many workbooks in parallel
+=================================================
+
+..module:: batch
+:platform: any
+:synopsis: build and save many workbooks with a headless engine in a pool of worker processes
+..moduleauthor:: Christian Prinoth < c.prinoth@quaestiocapital.com >
+
+The workers are started once and kept alive between calls, with pandas and the engine already imported. DataFrames
+and numpy arrays given to the jobs are handed over through shared memory rather than pickled.
+
+example:
+
+import pyXL.batch as XLB
+
+def build(wb, df, title):
+    wb.sheets[0].arng('A1').value(title)
+    wb.sheets[0].arng('A3').from_pandas(df)
+
+res = XLB.render([('client_%i.xlsx' % i, build, df, 'client %i' % i) for i, df in enumerate(frames)], workers=8)
+[r for r in res if r.error is not None] # failed jobs, with their traceback
+"""
+import os as _os
+import io as _io
+import time as _time
+import traceback as _traceback
+import contextlib as _contextlib
+import collections as _collections
+import concurrent.futures as _futures
+from concurrent.futures.process import BrokenProcessPool as _BrokenProcessPool
+from multiprocessing import shared_memory as _shared_memory, resource_tracker as _resource_tracker
+
+from pyXL.excel_utils import _share_arrays, _attach_arrays
+
+JobResult = _collections.namedtuple('JobResult', 'path seconds error')
+
+_excel = None # Excel object of a worker process
+_pool = None # (workers, engine, executor) of the parent process
+
+def _init_worker(engine):
+    """
+    import pyXL and switch to the engine once, when a worker process starts
+    :param engine:
+    :return:
+    """
+    global _excel
+    with _contextlib.redirect_stdout(_io.StringIO()):
+        import pyXL.excel as XL
+        XL.switch_engine(engine)
+    _excel = XL.Excel()
+
+def _ping():
+    return _os.getpid()
+
+def _reset_pool(pool=None):
+    """
+    forget the pool of worker processes
+    :param pool: only forget it if it is this pool, None for any pool
+    :return:
+    """
+    global _pool
+    if pool is None or (_pool is not None and _pool[2] is pool):
+        _pool = None
+
+if hasattr(_os, 'register_at_fork'):
+    _os.register_at_fork(after_in_child=_reset_pool)
+
+def warm(workers=None, engine='file'):
+    """
+    start the pool of worker processes used by render, if not already running; calling it ahead of time takes the
+    start up of the workers out of the first batch
+    :param workers: number of processes, None for one per cpu
+    :param engine: headless engine of the workers, 'file' (xlsxwriter) or 'fastxml'
+    :return: the pool (concurrent.futures.ProcessPoolExecutor)
+    """
+    global _pool
+    workers = workers or _os.cpu_count() or 1
+    if _pool is None or _pool[:2] != (workers, engine):
+        if _pool is not None:
+            _pool[2].shutdown()
+        # workers must share the resource tracker of this process, or they would unlink the shared memory segments
+        # they attach to when they exit
+        _resource_tracker.ensure_running()
+        pool = _futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,))
+        # processes may be started on demand only, one task per worker makes sure they are all up
+        _futures.wait([pool.submit(_ping) for i in range(workers)])
+        _pool = workers, engine, pool
+    return _pool[2]
+
+def _run(path, build, segment, args):
+    """
+    create, fill and close a workbook in a worker process
+    :param path: path of the workbook
+    :param build: function called as build(wb, *args)
+    :param segment: name of the shared memory segment of the arrays in args, or None
+    :param args: arguments of build, as given by _share_arrays
+    :return: JobResult
+    """
+    t = _time.perf_counter()
+    shm, wb, error = None, None, None
+    try:
+        if segment is not None:
+            shm = _shared_memory.SharedMemory(name=segment)
+        args = _attach_arrays(args, None if shm is None else shm.buf, copy=True)
+        wb = _excel.create_wb(path)
+        wb.deflate_threads = 1 # the pool already keeps all cpus busy
+        build(wb, *args)
+        wb.close()
+    except Exception:
+        error = _traceback.format_exc()
+        if wb in _excel.workbooks:
+            _excel.workbooks.remove(wb)
+    finally:
+        if shm is not None:
+            shm.close()
+    return JobResult(path, _time.perf_counter() - t, error)
+
+def _collect(path, future, shm, pool):
+    """
+    wait for a job, then release its shared memory segment
+    :return: JobResult
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        if isinstance(e, _BrokenProcessPool):
+            _reset_pool(pool)
+        return JobResult(path, None, _traceback.format_exc())
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+def render(jobs, workers=None, engine='file'):
+    """
+    build and save many workbooks in a pool of worker processes
+    jobs are submitted as they are read from the iterable, no more than two per worker being in flight at a time, so
+    that a generator of jobs is never fully held in memory
+    :param jobs: iterable of (path, build, *args) tuples: each workbook is created with create_wb(path), filled by
+                 build(wb, *args) and closed; build must be a module level function, as it is pickled, and the
+                 DataFrames and numpy arrays in args (also inside lists, tuples and dicts) are passed through shared
+                 memory
+    :param workers: number of processes, None for one per cpu
+    :param engine: headless engine of the workers, 'file' (xlsxwriter) or 'fastxml'
+    :return: list of JobResult(path, seconds, error) in the order of jobs, seconds being the time taken by the worker
+             to build and save the workbook, and error the traceback of a failed job or None
+             if a worker process dies, only the jobs in flight at the time fail, the next ones run in a new pool
+    """
+    limit = 2 * (workers or _os.cpu_count() or 1)
+    out, inflight = [], _collections.deque()
+    for job in jobs:
+        path, build, args = job[0], job[1], tuple(job[2:])
+        shm, args = _share_arrays(args)
+        task = _run, path, build, None if shm is None else shm.name, args
+        pool = warm(workers, engine) # a new pool if _collect found the previous one broken
+        future = _futures.Future()
+        try:
+            try:
+                future = pool.submit(*task)
+            except _BrokenProcessPool:
+                # a worker died since the last job was collected: the jobs in flight on the broken pool fail, this
+                # one is submitted to a new pool
+                _reset_pool(pool)
+                pool = warm(workers, engine)
+                future = pool.submit(*task)
+        except Exception as e:
+            future.set_exception(e)
+        inflight.append((path, future, shm, pool))
+        while len(inflight) >= limit:
+            out.append(_collect(*inflight.popleft()))
+    while inflight:
+        out.append(_collect(*inflight.popleft()))
+    return out
+
+def write_frames(wb, frames):
+    """
+    build function writing each DataFrame of a dict to its own sheet, at A1
+    eg render([('report.xlsx', write_frames, {'prices': df1, 'volumes': df2})])
+    :param wb: Workbook
+    :param frames: dict sheet name -> DataFrame
+    :return:
+    """
+    for i, (name, df) in enumerate(frames.items()):
+        if i == 0:
+            sheet = wb.sheets[0]
+            sheet.name = name
+        else:
+            sheet = wb.create_sheet(name)
+        sheet.arng('A1').from_pandas(df)
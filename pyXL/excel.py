@@ -34,7 +34,10 @@ def switch_engine(engine='xlsxwriter'):
                     not work in python 3; also, the new engine is object oriented, thus clearer and easier to use
                 win32com: new engine to remote control windows excel, same interface as the mac one
                 xlsxwriter/file: new engine to create excel files, uses same interface as the mac engine, with a subset
-                    of capabilities; specifically, it can not open or read existing files
+                    of capabilities; existing files are opened with open_wb in patch mode: their cells can be read
+                    (get_array, to_pandas), and values written to them are patched into the file on close
+                fastxml: same as xlsxwriter, but workbooks holding plain data are written by pyXL itself, which is much
+                    faster for large exports; other workbooks are still written with xlsxwriter
     :return:
     """
 
@@ -47,6 +50,15 @@ def switch_engine(engine='xlsxwriter'):
         this.engine=engine
         this.interactive =False
         print("Switched to XLSXWriter Excel engine")
+    elif engine in ('fastxml',):
+        import pyXL.excel_fastxml as XLFX
+        this.Excel = XLFX.Excel
+        this.Rng = XLFX.Rng
+        this.Workbook = XLFX.Workbook
+        this.Sheet = XLFX.Sheet
+        this.engine = engine
+        this.interactive = False
+        print("Switched to fastxml Excel engine")
     elif engine in ('applescript'):
         if my_platform != 'Darwin':
             print("Applescript engine only works on MacOS platforms, falling back to xlsxwriter")
@@ -161,7 +173,34 @@ def test():
     wb.saveas("test.xlsx")
     wb.close()
 
-def df2rng(df, rng=None, index_header='', skip_header=False, skip_index=False, sparse_mi=False, outline=None):
+def test_close_async(path='test_async.xlsx'):
+    """
+    routine to test that close_async of the headless engines saves the data as it was when called, even if the
+    DataFrame written to the workbook is changed while the file is saved in the background
+    :param path: path of the file written
+    :return:
+    """
+    from pandas import DataFrame
+    import numpy as np
+
+    x=this.Excel()
+    df=DataFrame({'a': np.arange(1000.), 'b': np.arange(1000), 'c': ['row %i' % i for i in range(1000)]})
+    expected=df.copy()
+    wb=x.create_wb(path)
+    wb.sheets[0].arng('A1').from_pandas(df, index=False)
+    future=wb.close_async()
+    df.iloc[0]=[-99., -99, 'changed'] # the caller reuses its frame at once
+    df['a']*=2
+    print(future.result())
+
+    saved=x.open_wb(path).sheets[0].arng('A1:C%i' % (len(df) + 1)).to_pandas(index=None)
+    assert (saved['a'].to_numpy()==expected['a'].to_numpy()).all(), "column a changed after close_async"
+    assert (saved['b'].to_numpy()==expected['b'].to_numpy()).all(), "column b changed after close_async"
+    assert (saved['c'].to_numpy()==expected['c'].to_numpy()).all(), "column c changed after close_async"
+    print("close_async saved the data as it was when called")
+
+def df2rng(df, rng=None, index_header='', skip_header=False, skip_index=False, sparse_mi=False, outline=None,
+           precision=None):
     """
     write a dataframe to an excel range
     :param df:
@@ -169,13 +208,16 @@ def df2rng(df, rng=None, index_header='', skip_header=False, skip_index=False, s
     :param index_header: override the name of the index of the df
     :param skip_header:
     :param skip_index:
-    :param sparse_mi: not used
+    :param sparse_mi: if True, MultiIndex labels are written only where they change; if 'merge', the cells spanned
+                      by each label are also merged
     :param outline: create subgroups and outline whenever this string appears in the index
+    :param precision: number of decimals floats are rounded to, for all float columns or as a dict {column: decimals}
     :return:
     """
     if isinstance(df,dict):
         for addr,sdf in df.items():
-            df2rng(sdf,addr,index_header=index_header,skip_header=skip_header,skip_index=skip_index,sparse_mi=sparse_mi,outline=outline)
+            df2rng(sdf,addr,index_header=index_header,skip_header=skip_header,skip_index=skip_index,sparse_mi=sparse_mi,outline=outline,
+                   precision=precision)
     else:
         x = this.Excel()
         n=len(x.workbooks)
@@ -193,7 +235,8 @@ def df2rng(df, rng=None, index_header='', skip_header=False, skip_index=False, s
             else:
                 range = r
 
-        range.from_pandas(df, header=not skip_header, index=not skip_index, index_label=index_header, outline_string=outline)
+        range.from_pandas(df, header=not skip_header, index=not skip_index, index_label=index_header, outline_string=outline,
+                          sparse_mi=sparse_mi, precision=precision)
 
 def rng2arr(rng=None, string_value=False, c=False):
     """
@@ -0,0 +1,1200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+:mod:`excel_fastxml` -- headless engine writing SpreadsheetML directly
+=====================================================================
+
+..module:: excel_fastxml
+:platform: any
+:synopsis: same interface and data store as the xlsxwriter engine, but plain data workbooks are serialized by pyXL
+           itself: numeric columns are formatted with vectorized numpy string operations, strings and categories are
+           factorized into the shared string table, and each sheet is streamed into the zip file one window of rows
+           at a time, without creating xlsxwriter objects; with several workers, sheets are serialized in parallel
+           processes reading the data of the blocks from shared memory; existing files opened with Excel.open_wb are
+           patched, only the sheets written to being rewritten and all other parts copied as stored, and their cells
+           are read by parsing the sheets incrementally, one row at a time
+..moduleauthor:: Christian Prinoth < c.prinoth@quaestiocapital.com >
+
+Workbooks using cell formats other than column number formats, images, charts, sparklines, tables, merged cells,
+conditional formats, row heights or outlines are written by the xlsxwriter engine instead.
+"""
+import os as _os
+import re as _re
+import zlib as _zlib
+import types as _types
+import datetime as _datetime
+import zipfile as _zipfile
+import hashlib as _hashlib
+import tempfile as _tempfile
+import posixpath as _posixpath
+import concurrent.futures as _futures
+import xml.etree.ElementTree as _ET
+import xml.parsers.expat as _expat
+from xml.sax.saxutils import unescape as _unescape
+from multiprocessing import shared_memory as _shared_memory, resource_tracker as _resource_tracker
+import numpy as _np
+import pandas as _pd
+
+import pyXL.excel_xlsxwriter as _XLXWR
+from pyXL.excel_xlsxwriter import Rng, Sheet, _zipinfo, _open_entry, _write_deflated, _copy_entry, \
+    _deflate_threads, _unlink_cached
+from pyXL.excel_utils import _a2cr, _n2x, _x2n, _iscol, _dt64_to_serial, _serial_to_dt64, _share_arrays, \
+    _attach_arrays, _hash_update
+
+_NS = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" ' \
+      'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_CT = 'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+_WINDOW = 2**18 # approximate number of cells serialized at a time
+_DATE_XF = 1 # index of the cell style with the date format of the workbook
+_STRING_TYPES = ('string', 'categorical') # inferred types of object columns written as shared strings
+_NUMBER_TYPES = ('integer', 'floating', 'mixed-integer-float', 'decimal') # ... and of those written as numbers
+_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_ROW = _re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', _re.S)
+_CELL = _re.compile(r'<c\b([^>]*?)(?:/>|>.*?</c>)', _re.S)
+_ROW_R = _re.compile(r'\sr="(\d+)"')
+_CELL_R = _re.compile(r'\sr="([A-Z]+)\d+"')
+_SPANS = _re.compile(r'\sspans="[^"]*"')
+_ATTR = _re.compile(r'([\w:.-]+)\s*=\s*(["\'])(.*?)\2', _re.S)
+_CELL_TYPES = {None: 0, 'n': 0, 's': 1, 'b': 2, 'str': 3, 'inlineStr': 3, 'e': 3, 'd': 4} # codes of cells read
+_DATE_FMT_IDS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59)) # built-in dates
+
+
+class Excel(_XLXWR.Excel):
+    """
+    basic wrapper of Excel application, see excel_xlsxwriter.Excel
+    """
+
+    def create_wb(self, name='Workbook.xlsx'):
+        """
+        create a new workbook
+        :return:
+        """
+        return Workbook(parent=self, name=name)
+
+
+class Workbook(_XLXWR.Workbook):
+    """
+    an object representing an Excel workbook, see excel_xlsxwriter.Workbook; only the way the file is written differs
+    """
+
+    def __init__(self, existing=None, parent=None, name='Workbook.xlsx'):
+        super().__init__(existing=existing, parent=parent if parent is not None else Excel(), name=name)
+        self.workers = None # processes serializing the sheets on close, None or 1 for none, 0 for one per cpu
+        self.source = None # existing file patched on close, see Excel.open_wb; None for new workbooks
+        self._read_cache = None # worksheet parts, shared strings and date styles of self.source, see _reader
+
+    def _open(self, fpath):
+        """
+        open an existing file in patch mode: its sheets are listed, empty, and the file is patched on close
+        :param fpath:
+        :return:
+        """
+        with _zipfile.ZipFile(fpath) as zf:
+            names = [name for name, part, worksheet in _package_parts(zf).sheets]
+        self.sheets = []
+        for name in names:
+            Sheet(existing=name, workbook=self)
+        self.source = fpath
+        self.saveas(fpath)
+
+    def _reader(self):
+        """
+        worksheet parts, shared strings and date styles of the file the workbook was opened from, read once
+        :return: namespace
+        """
+        if self._read_cache is None:
+            with _zipfile.ZipFile(self.source) as zf:
+                pkg = _package_parts(zf)
+                if pkg.shared_strings is not None and pkg.shared_strings in zf.NameToInfo:
+                    with zf.open(pkg.shared_strings) as fh:
+                        sst = _read_strings(fh)
+                else:
+                    sst = _np.zeros(0, dtype=object)
+                date_styles = _date_styles(zf.read(pkg.styles)) if pkg.styles is not None else _np.zeros(1, dtype=bool)
+            self._read_cache = _types.SimpleNamespace(
+                parts={name: part for name, part, worksheet in pkg.sheets if worksheet}, sst=sst,
+                date_styles=date_styles, date1904=pkg.date1904)
+        return self._read_cache
+
+    def _read_columns(self, sheet, c1, r1, c2, r2, typed=False):
+        """
+        values of a rectangle of cells of the file the workbook was opened from, see excel_xlsxwriter.Sheet._get_columns
+        the sheet is parsed incrementally up to the last row of the rectangle, and each column is converted with
+        vectorized operations, see _column_values
+        :param sheet: Sheet object
+        :param c1: left column, 1-based
+        :param r1: top row, 1-based
+        :param c2: right column, 1-based
+        :param r2: bottom row, 1-based
+        :param typed: see _column_values
+        :return: dict column -> (rows, values) arrays
+        """
+        if self.source is None:
+            return {}
+        reader = self._reader()
+        part = reader.parts.get(sheet.name)
+        if part is None or r2 < r1:
+            return {}
+        with _zipfile.ZipFile(self.source) as zf, zf.open(part) as fh:
+            cells = _read_cells(fh, c1, r1, c2, r2)
+        return {c: _column_values(*cells[c], reader, typed) for c in sorted(cells)}
+
+    def _plain(self):
+        """
+        True if the workbook only holds data (values, formulas, column widths and column number formats), which is
+        what the fast writer supports
+        :return:
+        """
+        return all(_plain_sheet(sheet) for sheet in self.sheets)
+
+    def content_hash(self):
+        """
+        see excel_xlsxwriter.Workbook.content_hash; for a workbook opened from an existing file, the path, size and
+        modification time of the file are hashed as well
+        :return: hex digest
+        """
+        digest = super().content_hash()
+        if self.source is None:
+            return digest
+        st = _os.stat(self.source)
+        h = _hashlib.sha1(digest.encode('ascii'))
+        _hash_update(h, [_os.path.abspath(self.source), st.st_size, st.st_mtime_ns])
+        return h.hexdigest()
+
+    def close(self, fileobj=None, stream=True):
+        """
+        close a workbook, which is only then written to disk (or to fileobj)
+        the file is always streamed, fileobj may be any writable stream (see excel_xlsxwriter.Workbook.close)
+        if self.workers is set, the sheets are serialized and compressed in parallel by a pool of processes, and the
+        finished parts are assembled in the package in order
+        a workbook opened from an existing file is patched instead, see _patch
+        :param fileobj: if given, the xlsx file is written to this file-like object instead of self.path
+        :param stream: ignored, only kept for compatibility with the xlsxwriter engine
+        :return:
+        """
+        if self.cache_dir is not None:
+            return self._close_cached(fileobj, stream)
+        if self.source is not None:
+            return self._patch(fileobj)
+        if not self._plain():
+            return super().close(fileobj=fileobj, stream=True)
+        if fileobj is None:
+            _unlink_cached(self.path)
+        # one cell style per number format, style 0 is the default one
+        xfs = {None: 0, self.date_format: _DATE_XF}
+        for sheet in self.sheets:
+            for fmt in sheet.cell_formats.values():
+                xfs.setdefault(fmt['num_format'], len(xfs))
+        names = [sheet.name for sheet in self.sheets]
+        level = self.compresslevel
+        with _zipfile.ZipFile(self.path if fileobj is None else fileobj, 'w', compression=_zipfile.ZIP_DEFLATED,
+                              compresslevel=level) as zf:
+            for name, xml in [('[Content_Types].xml', _content_types(len(names))), ('_rels/.rels', _root_rels()),
+                              ('xl/workbook.xml', _workbook_xml(names)),
+                              ('xl/_rels/workbook.xml.rels', _workbook_rels(len(names))),
+                              ('xl/styles.xml', _styles_xml(xfs))]:
+                zf.writestr(_zipinfo(name, level), xml.encode('utf-8'))
+            sst = {}
+            threads = _deflate_threads(self.deflate_threads)
+            workers = _os.cpu_count() if self.workers == 0 else self.workers
+            parts = _parallel_sheets(self.sheets, sst, xfs, level, workers) if workers and workers > 1 and \
+                len(self.sheets) > 1 else None
+            for i, sheet in enumerate(self.sheets):
+                info = _zipinfo('xl/worksheets/sheet%i.xml' % (i + 1), level)
+                if parts is not None:
+                    _write_deflated(zf, info, *parts[i].result())
+                    continue
+                ncells = sum(len(col) for hdr, cols, rows in sheet.blocks.values() for col in cols)
+                # zip64 records are only used when a sheet might exceed 4GB, as some readers do not expect them
+                with _open_entry(zf, info, threads, force_zip64=ncells * 64 > 2**32) as fh:
+                    for chunk in _sheet_xml(sheet, sst, xfs, selected=i == 0):
+                        fh.write(chunk.encode('utf-8'))
+            zf.writestr(_zipinfo('xl/sharedStrings.xml', level), _sst_xml(sst).encode('utf-8'))
+        self.parent.workbooks.remove(self)
+
+    def _patch(self, fileobj=None):
+        """
+        write a workbook opened from an existing file, see close: the rows of the sheets written to are merged with
+        the new cells, which replace existing cells at the same address, and all other parts are copied as they are
+        stored, without being decompressed
+        strings are written inline, so that the shared string table is left as it is, the cell styles of new number
+        formats are appended to the styles, and the calculation chain is dropped, excel recalculating the workbook
+        when the file is opened
+        only values, formulas and column number formats (which apply to the cells written) are supported; the file is
+        written to a temporary file next to self.path, which then replaces it, so self.path may be the source itself
+        :param fileobj: if given, the xlsx file is written to this file-like object instead of self.path
+        :return:
+        """
+        level = self.compresslevel
+        threads = _deflate_threads(self.deflate_threads)
+        if fileobj is None:
+            fd, tmp = _tempfile.mkstemp(suffix='.tmp', dir=_os.path.dirname(_os.path.abspath(self.path)))
+            _os.close(fd)
+        try:
+            with _zipfile.ZipFile(self.source) as src:
+                pkg = _package_parts(src)
+                parts = {name: (part, worksheet) for name, part, worksheet in pkg.sheets}
+                changed = {}
+                for sheet in self.sheets:
+                    if sheet.name not in parts:
+                        raise Exception("there is no sheet %s in %s, sheets cannot be added to or renamed in existing "
+                                        "files" % (sheet.name, self.source))
+                    if not _plain_sheet(sheet) or sheet.col_widths or sheet.panes is not None:
+                        raise Exception("only values, formulas and column number formats can be written to sheet %s "
+                                        "of an existing file" % sheet.name)
+                    if sheet.blocks or sheet.cell_data:
+                        part, worksheet = parts[sheet.name]
+                        if not worksheet:
+                            raise Exception("sheet %s is not a worksheet" % sheet.name)
+                        changed[part] = sheet
+                edits = {}
+                if changed:
+                    if pkg.styles is None:
+                        raise Exception("%s has no styles" % self.source)
+                    fmts = [self.date_format] + [fmt['num_format'] for sheet in changed.values()
+                                                 for fmt in sheet.cell_formats.values()]
+                    edits[pkg.styles], xfs = _patch_styles(src.read(pkg.styles).decode('utf-8'), fmts)
+                    edits[pkg.workbook] = _patch_workbook_xml(src.read(pkg.workbook).decode('utf-8'))
+                    if pkg.calc_chain is not None:
+                        rid, part = pkg.calc_chain
+                        edits[pkg.rels] = _drop_element(src.read(pkg.rels).decode('utf-8'), 'Relationship', 'Id', rid)
+                        edits['[Content_Types].xml'] = _drop_element(src.read('[Content_Types].xml').decode('utf-8'),
+                                                                     'Override', 'PartName', '/' + part)
+                        edits[part] = None
+                with _zipfile.ZipFile(tmp if fileobj is None else fileobj, 'w') as zf:
+                    for info in src.infolist():
+                        name = info.filename
+                        if name in changed:
+                            sheet = changed[name]
+                            cells = _sheet_cells(sheet, None, _col_styles(sheet, xfs), xfs[self.date_format])
+                            xml = _patch_sheet_xml(src.read(name).decode('utf-8'), cells)
+                            with _open_entry(zf, _zipinfo(name, level), threads,
+                                             force_zip64=sum(len(x) for x in xml) * 4 > 2**32) as fh:
+                                for chunk in xml:
+                                    fh.write(chunk.encode('utf-8'))
+                        elif name in edits:
+                            if edits[name] is not None:
+                                zf.writestr(_zipinfo(name, level), edits[name].encode('utf-8'))
+                        else:
+                            _copy_entry(zf, src, info)
+            if fileobj is None:
+                _os.replace(tmp, self.path)
+        finally:
+            if fileobj is None and _os.path.exists(tmp):
+                _os.remove(tmp)
+        self.parent.workbooks.remove(self)
+
+
+def _plain_sheet(sheet):
+    """
+    True if a sheet only holds data (values, formulas, column widths and column number formats), see
+    Workbook._plain
+    :param sheet: Sheet object
+    :return:
+    """
+    if sheet.cell_options or sheet.images or sheet.cond_formats or sheet.charts or sheet.sparklines or \
+            sheet.tables or sheet.merges or sheet.row_heights or len(sheet.outline_runs['start']) > 1 or \
+            sheet.outline_runs['level'][0] > 0:
+        return False
+    for addr, fmt in sheet.cell_formats.items():
+        if not _iscol(addr) or set(fmt) != {'num_format'}:
+            return False
+    return True
+
+def _escape(s):
+    """
+    escape a string for use in xml text or attributes; control characters are written as _xHHHH_, as excel does
+    :param s:
+    :return:
+    """
+    s = s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+    return _re.sub('[\x00-\x08\x0b\x0c\x0e-\x1f]', lambda m: '_x%04X_' % ord(m.group()), s)
+
+def _num_text(arr):
+    """
+    shortest text of an array of numbers, integral floats being written without decimals; each number is formatted
+    once, by python, which is faster than numpy's conversion to strings
+    :param arr: int or float array
+    :return: list of strings
+    """
+    if arr.dtype.kind != 'f':
+        return list(map(str, arr.tolist()))
+    with _np.errstate(invalid='ignore'):
+        integral = _np.isfinite(arr) & (_np.mod(arr, 1) == 0) & (_np.abs(arr) < 2**53)
+    if integral.all():
+        return list(map(str, arr.astype(_np.int64).tolist()))
+    # python floats are doubles: smaller floats keep the shortest text of their own precision through numpy
+    text = list(map(repr, arr.tolist())) if arr.dtype == _np.float64 else arr.astype(str).tolist()
+    for i, v in zip(_np.flatnonzero(integral).tolist(), arr[integral].astype(_np.int64).tolist()):
+        text[i] = str(v)
+    return text
+
+def _string_parts(s, sst):
+    """
+    type attribute and content of a cell holding a string
+    :param s: string
+    :param sst: shared string table, dict string -> index, or None to write the string in the cell
+    :return: (attributes, content)
+    """
+    if sst is None:
+        space = ' xml:space="preserve"' if s != s.strip() else ''
+        return ' t="inlineStr"', '<is><t%s>%s</t></is>' % (space, _escape(s))
+    return ' t="s"', '<v>%i</v>' % sst.setdefault(s, len(sst))
+
+def _cell_parts(v, sst, date_xf=_DATE_XF):
+    """
+    type/style attributes and content of a single cell, used for headers, single cell values and object columns
+    mixing different types
+    :param v: value
+    :param sst: shared string table, dict string -> index, or None for inline strings
+    :param date_xf: cell style of dates
+    :return: (attributes, content), or None for empty cells
+    """
+    if v is None:
+        return None
+    if isinstance(v, str):
+        if v[:1] == '=':
+            return '', '<f>%s</f>' % _escape(v[1:])
+        return _string_parts(v, sst)
+    if isinstance(v, (bool, _np.bool_)):
+        return ' t="b"', '<v>%i</v>' % int(v)
+    if isinstance(v, (int, _np.integer)):
+        return '', '<v>%i</v>' % v
+    if isinstance(v, (float, _np.floating)):
+        if _np.isnan(v):
+            return None
+        if _np.isinf(v):
+            return ' t="e"', '<f>%s1/0</f><v>#DIV/0!</v>' % ('-' if v < 0 else '')
+        return '', '<v>%s</v>' % _num_text(_np.array([v], dtype=float))[0]
+    if isinstance(v, (_datetime.date, _np.datetime64)):
+        ts = _pd.Timestamp(v)
+        if ts is _pd.NaT:
+            return None
+        if ts.tz is not None:
+            ts = ts.tz_localize(None)
+        return ' s="%i"' % date_xf, '<v>%s</v>' % _num_text(_dt64_to_serial(_np.array([ts.to_datetime64()])))[0]
+    return _string_parts(str(v), sst)
+
+def _column_cells(col, sst, style=None, inferred=None, date_xf=_DATE_XF):
+    """
+    attributes and content of the cells of (a slice of) a stored column, computed with vectorized operations unless
+    the column mixes values of different types
+    :param col: array of values, empty cells already dropped
+    :param sst: shared string table, dict string -> index, or None for inline strings
+    :param style: cell style of the number format of the column, or None
+    :param inferred: type of the values of an object column as given by pandas infer_dtype for the whole column, so
+                     that all its slices are written the same way; inferred from the slice if None
+    :param date_xf: cell style of dates without a number format
+    :return: (attributes, texts, content), attributes being a list of strings or a single string shared by all cells,
+             texts a list of strings, and content the format of the content of the cells from their text, '<v>%s</v>'
+             or '%s'
+    """
+    s = '' if style is None else ' s="%i"' % style
+    kind = col.dtype.kind
+    if kind in 'iuf':
+        text = _num_text(col)
+        if kind == 'f':
+            inf = _np.isinf(col)
+            if inf.any():
+                # as the xlsxwriter engine does with the nan_inf_to_errors option
+                text = list(map('<v>%s</v>'.__mod__, text))
+                for i in _np.flatnonzero(inf).tolist():
+                    text[i] = '<f>-1/0</f><v>#DIV/0!</v>' if col[i] < 0 else '<f>1/0</f><v>#DIV/0!</v>'
+                return _np.where(inf, ' t="e"', s).tolist(), text, '%s'
+        return s, text, '<v>%s</v>'
+    if kind == 'b':
+        return ' t="b"' + s, ['1' if v else '0' for v in col.tolist()], '<v>%s</v>'
+    if kind in 'mM':
+        return ' s="%i"' % (date_xf if style is None else style), _num_text(_dt64_to_serial(col)), '<v>%s</v>'
+    if inferred is None:
+        inferred = _pd.api.types.infer_dtype(col, skipna=True)
+    if inferred in _STRING_TYPES:
+        # each distinct label is looked up once, cells only carry their index in the shared string table
+        codes, uniques = _pd.factorize(col)
+        if sst is None:
+            attrs, text = zip(*[_string_parts(str(u), None) for u in uniques])
+            return _np.array([a + s for a in attrs], dtype=object)[codes].tolist(), \
+                _np.array(text, dtype=object)[codes].tolist(), '%s'
+        text = _np.array([str(sst.setdefault(str(u), len(sst))) for u in uniques], dtype=object)
+        return ' t="s"' + s, text[codes].tolist(), '<v>%s</v>'
+    if inferred in _NUMBER_TYPES:
+        return _column_cells(col.astype(float), sst, style)
+    if inferred == 'boolean':
+        return _column_cells(col.astype(bool), sst, style)
+    attrs, text = [], []
+    for v in col.tolist():
+        a, t = _cell_parts(v, sst, date_xf) or ('', '')
+        attrs.append(a if ' s=' in a else a + s)
+        text.append(t)
+    return attrs, text, '%s'
+
+def _column_strings(col, sst, inferred=None):
+    """
+    add the strings of a stored column to the shared string table, as _column_cells would when writing it
+    :param col: array of values, empty cells already dropped
+    :param sst: shared string table, dict string -> index
+    :param inferred: see _column_cells
+    :return:
+    """
+    if col.dtype.kind in 'iufbmM':
+        return
+    if inferred is None:
+        inferred = _pd.api.types.infer_dtype(col, skipna=True)
+    if inferred in _STRING_TYPES:
+        for u in _pd.factorize(col)[1]:
+            sst.setdefault(str(u), len(sst))
+    elif inferred not in _NUMBER_TYPES and inferred != 'boolean':
+        for v in col.tolist():
+            _cell_parts(v, sst)
+
+def _pane_xml(panes):
+    """
+    xml of the frozen panes of a sheet view
+    :param panes: (row, column), 0-based, of the top left cell of the unfrozen pane, or None
+    :return:
+    """
+    if panes is None or panes == (0, 0):
+        return ''
+    r, c = panes
+    active = 'bottomRight' if r and c else 'bottomLeft' if r else 'topRight'
+    return '<pane %s%stopLeftCell="%s%i" activePane="%s" state="frozen"/><selection pane="%s"/>' % (
+        'xSplit="%i" ' % c if c else '', 'ySplit="%i" ' % r if r else '', _n2x(c + 1), r + 1, active, active)
+
+def _col_width(w):
+    """
+    width of a column in the xml, from its width in characters (same conversion as xlsxwriter)
+    :param w:
+    :return:
+    """
+    if w < 1:
+        return int(int(w * 12 + 0.5) / 7. * 256) / 256.
+    return int((int(w * 7 + 0.5) + 5) / 7. * 256) / 256.
+
+def _col_styles(sheet, xfs):
+    """
+    cell style of the number format of each column of a sheet
+    :param sheet: Sheet object
+    :param xfs: cell styles, dict number format -> index
+    :return: dict column -> index
+    """
+    col_styles = {}
+    for addr, fmt in sheet.cell_formats.items():
+        c1, r1, c2, r2 = _a2cr(addr, f4=True)
+        for c in range(c1, c2 + 1):
+            col_styles[c] = xfs[fmt['num_format']]
+    return col_styles
+
+def _sheet_xml(sheet, sst, xfs, selected=False):
+    """
+    generate the xml of a worksheet in chunks, one window of rows at a time (see _sheet_cells)
+    :param sheet: Sheet object
+    :param sst: shared string table, dict string -> index, filled as strings are met
+    :param xfs: cell styles, dict number format -> index
+    :param selected: True for the first sheet
+    :return: generator of strings
+    """
+    col_styles = _col_styles(sheet, xfs)
+    out = [_HEADER, '<worksheet %s><sheetViews><sheetView %sworkbookViewId="0">%s</sheetView></sheetViews>'
+                    '<sheetFormatPr defaultRowHeight="15"/>' % (_NS, 'tabSelected="1" ' if selected else '',
+                                                                 _pane_xml(sheet.panes))]
+    cols = sorted(set(sheet.col_widths) | set(col_styles))
+    if cols:
+        out.append('<cols>')
+        for c in cols:
+            w = sheet.col_widths.get(c)
+            out.append('<col min="%i" max="%i" width="%r"%s%s/>' % (
+                c, c, _col_width(w) if w is not None else 9.140625, ' customWidth="1"' if w is not None else '',
+                ' style="%i"' % col_styles[c] if c in col_styles else ''))
+        out.append('</cols>')
+    out.append('<sheetData>')
+    yield ''.join(out)
+    for rr, cc, xx in _sheet_cells(sheet, sst, col_styles):
+        starts = _np.flatnonzero(_np.r_[True, rr[1:] != rr[:-1]])
+        cells = xx.tolist()
+        yield ''.join(['<row r="%i">%s</row>' % (r, ''.join(cells[a:b])) for r, a, b in
+                       zip(rr[starts].tolist(), starts.tolist(), starts[1:].tolist() + [len(cells)])])
+    yield '</sheetData><pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>' \
+          '</worksheet>'
+
+def _sheet_cells(sheet, sst, col_styles, date_xf=_DATE_XF):
+    """
+    generate the cells of a worksheet, one window of rows at a time; cells of all blocks and single cell values
+    falling in the window are sorted by row and column, a single cell value replacing a block value
+    :param sheet: Sheet object
+    :param sst: shared string table, dict string -> index, filled as strings are met, or None for inline strings
+    :param col_styles: cell style of the number format of each column, see _col_styles
+    :param date_xf: cell style of dates without a number format
+    :return: generator of (rows, columns, cell xml) arrays, the xml being an object array of strings
+    """
+    # block columns: (column, rows, values), cells are formatted window by window
+    specs = []
+    # header cells and single cell values: (row, column, attributes, content)
+    singles = []
+    for addr, (hdr, bcols, brows) in sheet.blocks.items():
+        c1, r1 = _a2cr(addr, f4=True)[:2]
+        for i, row in enumerate(hdr):
+            for j, v in enumerate(row):
+                singles.append((r1 + i, c1 + j, _cell_parts(v, sst, date_xf)))
+        r1 += len(hdr)
+        for j, (col, idx) in enumerate(zip(bcols, brows)):
+            specs.append((c1 + j, r1 + (_np.arange(len(col)) if idx is None else idx), col, _infer(col)))
+    for addr, v in sheet.cell_data.items():
+        c1, r1, c2, r2 = _a2cr(addr, f4=True)
+        if isinstance(v, str) and v[:1] == '{':
+            singles.append((r1, c1, ('', '<f t="array" ref="%s">%s</f>' % (addr, _escape(v[1:-1].lstrip('='))))))
+        elif isinstance(v, str) and v[:1] == '=':
+            singles.append((r1, c1, _cell_parts(v, sst, date_xf)))
+        else:
+            for r in range(r1, r2 + 1):
+                for c in range(c1, c2 + 1):
+                    singles.append((r, c, _cell_parts(v, sst, date_xf)))
+    singles = sorted([(r, c, p) for r, c, p in singles if p is not None], key=lambda x: x[0])
+    s_rows = _np.array([x[0] for x in singles], dtype=_np.int64)
+    s_xml = _np.array(['<c r="%s%i"%s>%s</c>' % (_n2x(c), r, a if c not in col_styles or ' s=' in a else
+                       a + ' s="%i"' % col_styles[c], t) for r, c, (a, t) in singles], dtype=object)
+    s_cols = _np.array([x[1] for x in singles], dtype=_np.int64)
+
+    bounds = [(int(r[0]), int(r[-1])) for c, r, col, inferred in specs if len(r)] + ([(int(s_rows[0]), int(s_rows[-1]))]
+                                                                           if len(singles) else [])
+    if bounds:
+        first, last = min(b[0] for b in bounds), max(b[1] for b in bounds)
+        step = max(1, _WINDOW // max(1, len(specs)))
+        for a in range(first, last + 1, step):
+            b = a + step
+            rr, cc, xx = [], [], []
+            for c, r, col, inferred in specs:
+                lo, hi = _np.searchsorted(r, [a, b])
+                if lo < hi:
+                    attrs, text, content = _column_cells(col[lo:hi], sst, col_styles.get(c), inferred, date_xf)
+                    rows = r[lo:hi]
+                    rr.append(rows)
+                    cc.append(_np.full(hi - lo, c))
+                    # each cell is formatted in a single operation, from the text of its value
+                    if isinstance(attrs, str):
+                        cell = '<c r="%s%%i"%s>%s</c>' % (_n2x(c), attrs, content)
+                        cells = map(cell.__mod__, zip(rows.tolist(), text))
+                    else:
+                        cell = '<c r="%s%%i"%%s>%s</c>' % (_n2x(c), content)
+                        cells = map(cell.__mod__, zip(rows.tolist(), attrs, text))
+                    xx.append(_np.array(list(cells), dtype=object))
+            lo, hi = _np.searchsorted(s_rows, [a, b])
+            if lo < hi:
+                rr.append(s_rows[lo:hi])
+                cc.append(s_cols[lo:hi])
+                xx.append(s_xml[lo:hi])
+            if not rr:
+                continue
+            rr, cc, xx = _np.concatenate(rr), _np.concatenate(cc), _np.concatenate(xx)
+            # stable sort, so that for duplicate cells the single cell values, which come last, are kept
+            order = _np.lexsort((cc, rr))
+            rr, cc, xx = rr[order], cc[order], xx[order]
+            keep = _np.r_[(rr[1:] != rr[:-1]) | (cc[1:] != cc[:-1]), True]
+            yield rr[keep], cc[keep], xx[keep]
+
+def _infer(col):
+    """
+    type of the values of an object column (see _column_cells), None for other columns
+    :param col:
+    :return:
+    """
+    return _pd.api.types.infer_dtype(col, skipna=True) if col.dtype.kind == 'O' else None
+
+def _sheet_strings(sheet, sst):
+    """
+    add all strings of a sheet to the shared string table, as _sheet_xml would when writing it
+    :param sheet: Sheet object
+    :param sst: shared string table, dict string -> index
+    :return: dict string -> index of the strings of the sheet
+    """
+    local = {}
+    for hdr, cols, rows in sheet.blocks.values():
+        for row in hdr:
+            for v in row:
+                _cell_parts(v, local)
+        for col in cols:
+            _column_strings(col, local, _infer(col))
+    for v in sheet.cell_data.values():
+        if not (isinstance(v, str) and v[:1] == '{'):
+            _cell_parts(v, local)
+    return {s: sst.setdefault(s, len(sst)) for s in local}
+
+def _export_sheet(sheet):
+    """
+    data of a sheet in a form that can be sent to a worker process, the arrays of the blocks being copied into a shared
+    memory segment (see excel_utils._share_arrays)
+    :param sheet: Sheet object
+    :return: (shared memory segment or None, dict of the attributes of the sheet read by _sheet_xml)
+    """
+    shm, blocks = _share_arrays(sheet.blocks)
+    return shm, {'blocks': blocks, 'cell_data': sheet.cell_data, 'cell_formats': sheet.cell_formats,
+                 'col_widths': sheet.col_widths, 'panes': sheet.panes}
+
+def _import_sheet(data, buf):
+    """
+    sheet-like object built by a worker process from the output of _export_sheet, block arrays being views of the
+    shared memory segment
+    :param data: dict of the attributes of the sheet
+    :param buf: buffer of the shared memory segment, or None
+    :return:
+    """
+    return _types.SimpleNamespace(**dict(data, blocks=_attach_arrays(data['blocks'], buf)))
+
+def _deflate(chunks, level=None):
+    """
+    compress a part of the xlsx file given as a sequence of strings, the way zipfile would store it
+    :param chunks: iterable of strings
+    :param level: zlib level, None for the default
+    :return: (raw deflate stream, crc32, uncompressed size)
+    """
+    co = _zlib.compressobj(_zlib.Z_DEFAULT_COMPRESSION if level is None else level, _zlib.DEFLATED, -15)
+    out, crc, size = [], 0, 0
+    for chunk in chunks:
+        b = chunk.encode('utf-8')
+        crc, size = _zlib.crc32(b, crc), size + len(b)
+        out.append(co.compress(b))
+    out.append(co.flush())
+    return b''.join(out), crc, size
+
+def _sheet_part(segment, data, sst, xfs, selected, level):
+    """
+    serialize and compress a sheet in a worker process
+    :param segment: name of the shared memory segment of the block arrays, or None
+    :param data: dict of the attributes of the sheet, see _export_sheet
+    :param sst: dict string -> index of all strings of the sheet in the shared string table of the workbook
+    :param xfs: cell styles, dict number format -> index
+    :param selected: True for the first sheet
+    :param level: zlib level, None for the default
+    :return: see _deflate
+    """
+    shm = None if segment is None else _shared_memory.SharedMemory(name=segment)
+    try:
+        n = len(sst)
+        part = _deflate(_sheet_xml(_import_sheet(data, None if shm is None else shm.buf), sst, xfs, selected), level)
+        assert len(sst) == n, 'shared strings of the sheet were not all collected before serialization'
+        return part
+    finally:
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                pass # views are still referenced by the traceback of a failed serialization
+
+_pool = None
+
+def _process_pool(workers):
+    """
+    pool of processes shared by all workbooks, created on first use and kept alive, so that later workbooks do not pay
+    for starting the processes again; it is recreated if a different number of workers is asked for
+    :param workers: number of processes
+    :return:
+    """
+    global _pool
+    if _pool is None or _pool[0] != workers:
+        if _pool is not None:
+            _pool[1].shutdown()
+        # workers must share the resource tracker of this process, or they would unlink the shared memory segments
+        # they attach to when they exit
+        _resource_tracker.ensure_running()
+        _pool = workers, _futures.ProcessPoolExecutor(max_workers=workers)
+    return _pool[1]
+
+def _reset_pool():
+    """
+    forget the pool of processes in a forked child process, where it cannot be used
+    :return:
+    """
+    global _pool
+    _pool = None
+
+if hasattr(_os, 'register_at_fork'):
+    _os.register_at_fork(after_in_child=_reset_pool)
+
+def _parallel_sheets(sheets, sst, xfs, level, workers):
+    """
+    serialize and compress all sheets in a pool of processes; the strings of all sheets are added to the shared string
+    table first, so that each process knows the index of the strings it writes
+    :param sheets: list of Sheet objects
+    :param sst: shared string table of the workbook, dict string -> index, filled by this function
+    :param xfs: cell styles, dict number format -> index
+    :param level: zlib level, None for the default
+    :param workers: number of processes
+    :return: list of futures returning the output of _deflate for each sheet
+    """
+    pool = _process_pool(workers)
+    parts, segments = [], []
+    try:
+        for i, sheet in enumerate(sheets):
+            strings = _sheet_strings(sheet, sst)
+            shm, data = _export_sheet(sheet)
+            if shm is not None:
+                segments.append(shm)
+            parts.append(pool.submit(_sheet_part, None if shm is None else shm.name, data, strings, xfs, i == 0,
+                                     level))
+        _futures.wait(parts)
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+    return parts
+
+def _sst_xml(sst):
+    """
+    xml of the shared string table
+    :param sst: dict string -> index, in order of index
+    :return:
+    """
+    out = [_HEADER, '<sst %s count="%i" uniqueCount="%i">' % (_NS.split(' ')[0], len(sst), len(sst))]
+    for s in sst:
+        space = ' xml:space="preserve"' if s != s.strip() else ''
+        out.append('<si><t%s>%s</t></si>' % (space, _escape(s)))
+    out.append('</sst>')
+    return ''.join(out)
+
+def _styles_xml(xfs):
+    """
+    xml of the styles: default font, fill and border, and one cell style per number format
+    :param xfs: dict number format -> index of the cell style, None being the default style
+    :return:
+    """
+    fmts = [f for f in xfs if f is not None]
+    out = [_HEADER, '<styleSheet %s>' % _NS.split(' ')[0], '<numFmts count="%i">' % len(fmts)]
+    out += ['<numFmt numFmtId="%i" formatCode="%s"/>' % (164 + i, _escape(f)) for i, f in enumerate(fmts)]
+    out.append('</numFmts><fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+               '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+               '<fill><patternFill patternType="gray125"/></fill></fills>'
+               '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+               '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>')
+    out.append('<cellXfs count="%i"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>' % len(xfs))
+    out += ['<xf numFmtId="%i" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>' % (164 + i)
+            for i in range(len(fmts))]
+    out.append('</cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+               '</styleSheet>')
+    return ''.join(out)
+
+def _workbook_xml(names):
+    sheets = ''.join('<sheet name="%s" sheetId="%i" r:id="rId%i"/>' % (_escape(n), i + 1, i + 1)
+                     for i, n in enumerate(names))
+    return _HEADER + '<workbook %s><bookViews><workbookView/></bookViews><sheets>%s</sheets>' \
+                     '<calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>' % (_NS, sheets)
+
+def _workbook_rels(n):
+    rels = ['<Relationship Id="rId%i" Type="%sworksheet" Target="worksheets/sheet%i.xml"/>' % (i + 1, _REL, i + 1)
+            for i in range(n)]
+    rels.append('<Relationship Id="rId%i" Type="%sstyles" Target="styles.xml"/>' % (n + 1, _REL))
+    rels.append('<Relationship Id="rId%i" Type="%ssharedStrings" Target="sharedStrings.xml"/>' % (n + 2, _REL))
+    return _HEADER + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">%s' \
+                     '</Relationships>' % ''.join(rels)
+
+def _root_rels():
+    return _HEADER + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' \
+                     '<Relationship Id="rId1" Type="%sofficeDocument" Target="xl/workbook.xml"/></Relationships>' % _REL
+
+def _content_types(n):
+    parts = ['<Override PartName="/xl/worksheets/sheet%i.xml" ContentType="%sworksheet+xml"/>' % (i + 1, _CT)
+             for i in range(n)]
+    return _HEADER + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">' \
+                     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>' \
+                     '<Default Extension="xml" ContentType="application/xml"/>' \
+                     '<Override PartName="/xl/workbook.xml" ContentType="%ssheet.main+xml"/>%s' \
+                     '<Override PartName="/xl/styles.xml" ContentType="%sstyles+xml"/>' \
+                     '<Override PartName="/xl/sharedStrings.xml" ContentType="%ssharedStrings+xml"/></Types>' % \
+           (_CT, ''.join(parts), _CT, _CT)
+
+def _attrs(text):
+    """
+    attributes of an xml start tag
+    :param text: attributes part of the tag
+    :return: dict name -> unescaped value
+    """
+    return {k: _unescape(v, {'&quot;': '"', '&apos;': "'"}) for k, q, v in _ATTR.findall(text)}
+
+def _elements(xml, tag):
+    """
+    elements with a given tag in an xml string, without parsing it
+    :param xml:
+    :param tag:
+    :return: iterator of match objects, group 1 being the attributes and group 2 the content (None if empty)
+    """
+    return _re.finditer(r'<%s\b([^>]*?)(?:/>|>(.*?)</%s>)' % (tag, tag), xml, _re.S)
+
+def _drop_element(xml, tag, attr, value):
+    """
+    remove the elements with a given attribute value from an xml string
+    :param xml:
+    :param tag:
+    :param attr: name of the attribute
+    :param value: value of the attribute
+    :return:
+    """
+    for m in reversed(list(_elements(xml, tag))):
+        if _attrs(m.group(1)).get(attr) == value:
+            xml = xml[:m.start()] + xml[m.end():]
+    return xml
+
+def _part_name(folder, target):
+    """
+    name of the zip entry of a relationship target
+    :param folder: folder of the source part, eg xl
+    :param target: target, relative to folder or absolute
+    :return:
+    """
+    if target.startswith('/'):
+        return target[1:]
+    return _posixpath.normpath(_posixpath.join(folder, target))
+
+def _package_parts(zf):
+    """
+    parts of an existing xlsx file
+    :param zf: ZipFile open for reading
+    :return: namespace with the names of the workbook part and of its relationships, styles and shared_strings
+             (None if missing), calc_chain (relationship id and part, None if missing), date1904, and sheets: (name,
+             part, True for worksheets) in the order of the workbook
+    """
+    root = _ET.fromstring(zf.read('_rels/.rels'))
+    workbook = [_part_name('', r.get('Target')) for r in root.iter(_PKG_REL + 'Relationship')
+                if r.get('Type').endswith('/officeDocument')][0]
+    folder, base = _posixpath.split(workbook)
+    rels = _posixpath.join(folder, '_rels', base + '.rels')
+    targets = {r.get('Id'): (r.get('Type').rsplit('/', 1)[-1], _part_name(folder, r.get('Target')))
+               for r in _ET.fromstring(zf.read(rels)).iter(_PKG_REL + 'Relationship')}
+    root = _ET.fromstring(zf.read(workbook))
+    sheets = []
+    for sheet in root.iter(_MAIN + 'sheet'):
+        rid = [v for k, v in sheet.attrib.items() if k.endswith('}id')][0]
+        kind, part = targets[rid]
+        sheets.append((sheet.get('name'), part, kind == 'worksheet'))
+    pr = root.find(_MAIN + 'workbookPr')
+    styles = [part for kind, part in targets.values() if kind == 'styles']
+    shared_strings = [part for kind, part in targets.values() if kind == 'sharedStrings']
+    calc_chain = [(rid, part) for rid, (kind, part) in targets.items() if kind == 'calcChain']
+    return _types.SimpleNamespace(workbook=workbook, rels=rels, sheets=sheets, styles=styles[0] if styles else None,
+                                  shared_strings=shared_strings[0] if shared_strings else None,
+                                  calc_chain=calc_chain[0] if calc_chain else None,
+                                  date1904=pr is not None and pr.get('date1904') in ('1', 'true'))
+
+def _patch_styles(xml, fmts):
+    """
+    add cell styles with the given number formats to the styles of an existing file, reusing existing number formats
+    and plain cell styles
+    :param xml: xml of the styles part
+    :param fmts: number formats
+    :return: (patched xml, dict number format -> index of its cell style)
+    """
+    ids = {'General': 0}
+    for m in _elements(xml, 'numFmt'):
+        a = _attrs(m.group(1))
+        ids.setdefault(a['formatCode'], int(a['numFmtId']))
+    new_fmts = []
+    for f in fmts:
+        if f not in ids:
+            ids[f] = max([163] + list(ids.values())) + 1
+            new_fmts.append(f)
+    m = next(_elements(xml, 'cellXfs'), None)
+    if m is None:
+        raise Exception("there are no cell styles in the styles part")
+    cell_xfs = m.group(2) or ''
+    plain = {}
+    n = 0
+    for x in _elements(cell_xfs, 'xf'):
+        a = _attrs(x.group(1))
+        if x.group(2) is None and all(a.get(k, '0') == '0' for k in ('fontId', 'fillId', 'borderId', 'xfId')) and \
+                set(a) <= {'numFmtId', 'fontId', 'fillId', 'borderId', 'xfId', 'applyNumberFormat'}:
+            plain.setdefault(int(a.get('numFmtId', 0)), n)
+        n += 1
+    xfs, new_xfs = {}, []
+    for f in fmts:
+        if ids[f] not in plain:
+            plain[ids[f]] = n + len(new_xfs)
+            new_xfs.append('<xf numFmtId="%i" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>' %
+                           ids[f])
+        xfs[f] = plain[ids[f]]
+    xml = xml[:m.start()] + '<cellXfs count="%i">%s%s</cellXfs>' % (n + len(new_xfs), cell_xfs, ''.join(new_xfs)) + \
+        xml[m.end():]
+    if new_fmts:
+        num_fmts = ''.join('<numFmt numFmtId="%i" formatCode="%s"/>' % (ids[f], _escape(f)) for f in new_fmts)
+        m = next(_elements(xml, 'numFmts'), None)
+        if m is None:
+            m = _re.search(r'<styleSheet\b[^>]*>', xml)
+            xml = xml[:m.end()] + '<numFmts count="%i">%s</numFmts>' % (len(new_fmts), num_fmts) + xml[m.end():]
+        else:
+            count = sum(1 for x in _elements(m.group(2) or '', 'numFmt')) + len(new_fmts)
+            xml = xml[:m.start()] + '<numFmts count="%i">%s%s</numFmts>' % (count, m.group(2) or '', num_fmts) + \
+                xml[m.end():]
+    return xml, xfs
+
+def _patch_workbook_xml(xml):
+    """
+    set the workbook of an existing file to be fully recalculated when opened
+    :param xml: xml of the workbook part
+    :return:
+    """
+    m = _re.search(r'<calcPr\b([^>]*?)(/?)>', xml)
+    if m is not None:
+        attrs = _re.sub(r'\sfullCalcOnLoad\s*=\s*(["\']).*?\1', '', m.group(1)).rstrip()
+        return xml[:m.start()] + '<calcPr%s fullCalcOnLoad="1"%s>' % (attrs, m.group(2)) + xml[m.end():]
+    # calcPr goes before these elements, if present
+    m = _re.search(r'<(?:oleSize|customWorkbookViews|pivotCaches|smartTagPr|smartTagTypes|webPublishing|'
+                   r'fileRecoveryPr|webPublishObjects|extLst)\b|</workbook>', xml)
+    return xml[:m.start()] + '<calcPr fullCalcOnLoad="1"/>' + xml[m.start():]
+
+def _new_rows(cells):
+    """
+    group new cells by row
+    :param cells: generator of (rows, columns, cell xml) arrays sorted by row and column, see _sheet_cells
+    :return: generator of (row, list of columns, list of cell xml)
+    """
+    for rr, cc, xx in cells:
+        starts = _np.flatnonzero(_np.r_[True, rr[1:] != rr[:-1]])
+        ends = _np.r_[starts[1:], len(rr)]
+        for a, b in zip(starts.tolist(), ends.tolist()):
+            yield int(rr[a]), cc[a:b].tolist(), xx[a:b].tolist()
+
+def _merge_row(r, attrs, body, cols, cells):
+    """
+    xml of an existing row with new cells, which replace existing cells in the same columns
+    :param r: row
+    :param attrs: attributes of the existing row
+    :param body: content of the existing row
+    :param cols: columns of the new cells
+    :param cells: xml of the new cells
+    :return:
+    """
+    old = {}
+    c = 0
+    for m in _CELL.finditer(body):
+        a = _CELL_R.search(m.group(1))
+        c = _x2n(a.group(1)) if a is not None else c + 1
+        old[c] = m.group() if a is not None else '<c r="%s%i"%s' % (_n2x(c), r, m.group()[2:])
+    for c in cols:
+        if c in old and _re.search(r'<f\b[^>]*\sref=', old[c]):
+            raise Exception("cell %s%i holds the master formula of a range of cells and cannot be replaced" %
+                            (_n2x(c), r))
+    old.update(zip(cols, cells))
+    return '<row r="%i"%s>%s</row>' % (r, _SPANS.sub('', _ROW_R.sub('', attrs)),
+                                        ''.join(old[c] for c in sorted(old)))
+
+def _patch_sheet_xml(xml, cells):
+    """
+    merge new cells into the xml of an existing worksheet, a new cell replacing an existing one at the same address;
+    the dimension of the sheet is extended to the new cells
+    :param xml: xml of the worksheet
+    :param cells: new cells, generator of (rows, columns, cell xml) arrays sorted by row and column, see _sheet_cells
+    :return: list of strings, the patched xml
+    """
+    start = xml.find('<sheetData')
+    if start < 0:
+        raise Exception("the worksheet has no sheetData")
+    gt = xml.find('>', start)
+    if xml[gt - 1] == '/':
+        body, end = '', gt + 1
+    else:
+        close = xml.find('</sheetData>', gt)
+        body, end = xml[gt + 1:close], close + len('</sheetData>')
+    out = ['<sheetData>']
+    rows = _new_rows(cells)
+    new = next(rows, None)
+    bounds = []
+    r = 0
+    for m in _ROW.finditer(body):
+        a = _ROW_R.search(m.group(1))
+        r = int(a.group(1)) if a is not None else r + 1
+        while new is not None and new[0] < r:
+            out.append('<row r="%i">%s</row>' % (new[0], ''.join(new[2])))
+            bounds.append((new[0], new[1][0], new[1][-1]))
+            new = next(rows, None)
+        if new is not None and new[0] == r:
+            out.append(_merge_row(r, m.group(1), m.group(2) or '', new[1], new[2]))
+            bounds.append((new[0], new[1][0], new[1][-1]))
+            new = next(rows, None)
+        else:
+            out.append(m.group() if a is not None else '<row r="%i"%s' % (r, m.group()[4:]))
+    while new is not None:
+        out.append('<row r="%i">%s</row>' % (new[0], ''.join(new[2])))
+        bounds.append((new[0], new[1][0], new[1][-1]))
+        new = next(rows, None)
+    out.append('</sheetData>')
+    head = xml[:start]
+    m = _re.search(r'(<dimension\b[^>]*?\sref=")([^"]*)"', head)
+    if m is not None and bounds:
+        c1, r1, c2, r2 = _a2cr(m.group(2), f4=True)
+        r1, r2 = min(r1, bounds[0][0]), max(r2, bounds[-1][0])
+        c1, c2 = min([c1] + [b[1] for b in bounds]), max([c2] + [b[2] for b in bounds])
+        head = head[:m.start()] + '%s%s%i:%s%i"' % (m.group(1), _n2x(c1), r1, _n2x(c2), r2) + head[m.end():]
+    return [head] + out + [xml[end:]]
+
+def _read_strings(fh):
+    """
+    read the shared string table of an existing file with an incremental (expat) parser, joining the runs of rich text
+    and leaving out phonetic runs
+    :param fh: file object of the shared strings part
+    :return: object array of strings
+    """
+    si, t, rph = _MAIN[1:-1] + '}si', _MAIN[1:-1] + '}t', _MAIN[1:-1] + '}rPh'
+    out, pieces = [], []
+    collect = phonetic = False
+
+    def start(tag, attrs):
+        nonlocal collect, phonetic
+        if tag == t and not phonetic:
+            collect = True
+        elif tag == rph:
+            phonetic = True
+
+    def end(tag):
+        nonlocal collect, phonetic
+        if tag == t:
+            collect = False
+        elif tag == si:
+            out.append(''.join(pieces))
+            pieces.clear()
+        elif tag == rph:
+            phonetic = False
+
+    def data(text):
+        if collect:
+            pieces.append(text)
+
+    parser = _expat.ParserCreate(namespace_separator='}')
+    parser.buffer_text = True
+    parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler = start, end, data
+    parser.ParseFile(fh)
+    return _np.array(out, dtype=object)
+
+def _is_date_format(code):
+    """
+    True if a number format shows dates or times, that is has date or time codes outside of literal text, escaped
+    characters, colors and conditions
+    :param code: format code of the positive section
+    :return:
+    """
+    code = _re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', '', code.split(';')[0])
+    return _re.search('[dmyhs]', code, _re.I) is not None
+
+def _date_styles(xml):
+    """
+    which cell styles of an existing file have a date or time number format
+    :param xml: xml of the styles part
+    :return: bool array, one item per cell style plus a last False one for styles out of range
+    """
+    root = _ET.fromstring(xml)
+    codes = {int(f.get('numFmtId')): f.get('formatCode', '') for f in root.iter(_MAIN + 'numFmt')}
+    xfs = root.find(_MAIN + 'cellXfs')
+    out = []
+    for xf in [] if xfs is None else xfs.iter(_MAIN + 'xf'):
+        i = int(xf.get('numFmtId', 0))
+        out.append(_is_date_format(codes[i]) if i in codes else i in _DATE_FMT_IDS)
+    return _np.array(out + [False], dtype=bool)
+
+def _read_cells(fh, c1, r1, c2, r2):
+    """
+    read the cells of a rectangle of an existing worksheet with an incremental (expat) parser: no tree is built, only
+    the cells in the rectangle are kept, and parsing stops past the last row of the rectangle
+    :param fh: file object of the worksheet part
+    :param c1: left column, 1-based
+    :param r1: top row, 1-based
+    :param c2: right column, 1-based
+    :param r2: bottom row, 1-based
+    :return: dict column -> (rows, type codes, styles, texts) lists, see _CELL_TYPES; cells without a value are left out
+    """
+    row, c_, v, is_, t, rph = [_MAIN[1:-1] + '}' + tag for tag in ('row', 'c', 'v', 'is', 't', 'rPh')]
+    cells, letters, pieces = {}, {}, []
+    r = c = 0
+    keep = done = collect = phonetic = False
+    cell = None # column, type and style of the cell being read, if in the rectangle
+    value = False # True once the value of the cell is met
+
+    def start(tag, attrs):
+        nonlocal r, c, keep, done, collect, phonetic, cell, value
+        if tag == c_:
+            a = attrs.get('r')
+            if a is None:
+                c += 1
+            else:
+                a = a.rstrip('0123456789')
+                c = letters.get(a) or letters.setdefault(a, _x2n(a))
+            cell = (c, attrs.get('t'), attrs.get('s')) if keep and c1 <= c <= c2 else None
+            value = False
+        elif cell is None:
+            if tag == row:
+                r, c = int(attrs.get('r', r + 1)), 0
+                keep = r1 <= r <= r2
+                done = r > r2
+        elif tag == v or tag == t and not phonetic:
+            collect = value = True
+        elif tag == rph:
+            phonetic = True
+
+    def end(tag):
+        nonlocal collect, phonetic, cell
+        if tag == c_:
+            text = ''.join(pieces)
+            # formulas never calculated may have an empty value
+            if cell is not None and value and (text or cell[1] in ('str', 'inlineStr')):
+                col = cells.get(cell[0])
+                if col is None:
+                    col = cells[cell[0]] = ([], [], [], [])
+                col[0].append(r)
+                col[1].append(_CELL_TYPES.get(cell[1], 3))
+                col[2].append(int(cell[2] or 0))
+                col[3].append(text)
+            pieces.clear()
+            cell = None
+        elif tag == v or tag == t:
+            collect = False
+        elif tag == rph:
+            phonetic = False
+
+    def data(text):
+        if collect:
+            pieces.append(text)
+
+    parser = _expat.ParserCreate(namespace_separator='}')
+    parser.buffer_text = True
+    parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler = start, end, data
+    while not done:
+        chunk = fh.read(2**16)
+        parser.Parse(chunk, not chunk)
+        if not chunk:
+            break
+    return cells
+
+def _column_values(rows, types, styles, texts, reader, typed=False):
+    """
+    convert the cells of a column read by _read_cells, with vectorized operations for each type of cell
+    :param rows: rows of the cells
+    :param types: type codes of the cells, see _CELL_TYPES
+    :param styles: cell styles of the cells
+    :param texts: texts of the values of the cells
+    :param reader: see Workbook._reader
+    :param typed: if True, columns only holding numbers (or dates) are returned as float (or datetime64) arrays;
+                  otherwise values are always python objects, dates being datetime.datetime
+    :return: (rows, values) arrays
+    """
+    rows = _np.array(rows, dtype=_np.int64)
+    types = _np.array(types, dtype=_np.int8)
+    texts = _np.array(texts, dtype=object)
+    num = types == 0
+    dates = num & reader.date_styles[_np.minimum(_np.array(styles, dtype=_np.int64), len(reader.date_styles) - 1)]
+    num &= ~dates
+    if typed and num.all():
+        return rows, texts.astype(float)
+    if typed and dates.all():
+        return rows, _serial_to_dt64(texts.astype(float), reader.date1904)
+    values = texts.copy()
+    if num.any():
+        values[num] = texts[num].astype(float)
+    if dates.any():
+        values[dates] = _serial_to_dt64(texts[dates].astype(float), reader.date1904).astype('M8[us]').astype(object)
+    strings = types == 1
+    if strings.any():
+        values[strings] = reader.sst[texts[strings].astype(_np.int64)]
+    bools = types == 2
+    if bools.any():
+        values[bools] = texts[bools] == '1'
+    iso = types == 4
+    if iso.any():
+        values[iso] = _pd.to_datetime(texts[iso]).to_pydatetime()
+    return rows, values
@@ -24,7 +24,9 @@ import datetime as _datetime
 import numpy as _np
 from copy import copy as _copy
 from pyXL import excelpath as _excelpath
-from pyXL.excel_utils import _cr2a, _a2cr, _n2x, _x2n, _splitaddr, _df2outline, _isnumeric, _df_to_ll
+from pyXL.excel_utils import _cr2a, _a2cr, _n2x, _x2n, _splitaddr, _df2outline, _isnumeric, _df_to_ll, \
+    _dtype_formats, _sparse_mi_mask, _sparse_mi_runs, _precision_digits, _round_frame, \
+    _split_overflow
 
 class Rng:
     """
@@ -452,7 +454,8 @@ class Rng:
             temp=_parse_aslist(temp)
             return temp
 
-    def from_pandas(self, pdobj, header=True, index=True, index_label=None, outline_string=None):
+    def from_pandas(self, pdobj, header=True, index=True, index_label=None, outline_string=None, dtype_fmt=None,
+                    sparse_mi=False, precision=None, overflow=None, max_rows=None, max_bytes=None):
         """
                 write a pandas object to excel
         :param pdobj: any DataFrame or Series object
@@ -463,15 +466,39 @@ class Rng:
         :param index: if False, strip index
         :param index_label: index header
         :param outline_string: a string used to identify outline main levels (eg " All")
+        :param dtype_fmt: if True, number formats are set on each column according to its dtype
+                          (see excel_utils._DTYPE_FORMATS), a dict may be used to override the default formats
+        :param sparse_mi: if True, MultiIndex labels are written only where they change; if 'merge', the cells spanned
+                          by each label are also merged
+        :param precision: number of decimals floats are rounded to before being written, either for all float columns
+                          or as a dict {column label: number of decimals}; defaults to the precision of the workbook
+        :param overflow: if 'sheets' or 'files', a frame that does not fit below the range (or exceeds max_rows or
+                         max_bytes) is split across continuation sheets or workbooks, see excel_utils._split_overflow
+        :param max_rows: maximum number of data rows per sheet when overflow is set
+        :param max_bytes: maximum estimated size of the sheet data per sheet when overflow is set
         :return:
         """
+        if overflow is not None:
+            return _split_overflow(self, pdobj, overflow, max_rows, max_bytes, header=header, index=index,
+                                   index_label=index_label, outline_string=outline_string, dtype_fmt=dtype_fmt,
+                                   sparse_mi=sparse_mi, precision=precision)
         crt_size = 5000
         i=0
         if pdobj.ndim==1: pdobj=pdobj.to_frame()
+        # rounded values are also shorter literals in the script sent to excel
+        pdobj = _round_frame(pdobj, _precision_digits(pdobj, precision, self.sheet.workbook.precision))
+        top = self.offset(r=pdobj.columns.nlevels if header else 0, c=0)
+        # the mask is computed on the whole frame, so that labels are not repeated at the start of each chunk
+        mask = _sparse_mi_mask(pdobj.index) if sparse_mi and index else None
+        if dtype_fmt:
+            nhdr = (pdobj.columns.nlevels if header else 0)
+            full = self.resize(pdobj.shape[0] + nhdr, pdobj.shape[1] + (pdobj.index.nlevels if index else 0))
+            fmts = _dtype_formats(pdobj, index=index, policy=dtype_fmt)
         nrows=int(crt_size/pdobj.shape[1])
         while i<pdobj.shape[0]:
             subpdobj=pdobj.iloc[i:i+nrows,:]
-            temp = _df_to_ll(subpdobj,header=header if i==0 else False, index=index)
+            temp = _df_to_ll(subpdobj,header=header if i==0 else False, index=index,
+                             sparse_mi=mask[i:i+nrows] if mask is not None else False)
             asll = _pylist2as(temp)
             trange = self.resize(len(temp), len(temp[0]))
             if i>0: trange=trange.offset(r=i+1,c=0)
@@ -490,6 +517,25 @@ class Rng:
         temp=_asrun(script)
         temp=temp.replace('$','').replace('"','')
         self.address=temp
+        if dtype_fmt:
+            instr = ''
+            for j, fmt in enumerate(fmts):
+                if fmt is not None:
+                    instr += 'set number format of column %i of rng to "%s"\n' % (j + 1, fmt.replace('"', '\\"'))
+            if len(instr) > 0:
+                script = """
+                %s
+                %s
+                """ % (full._build_dest(), instr)
+                _asrun(script)
+        if sparse_mi == 'merge' and mask is not None:
+            c1, r1 = _a2cr(top.address, f4=True)[:2]
+            instr = ''
+            for k, f, l in _sparse_mi_runs(mask):
+                instr += 'merge range "%s" of worksheet "%s" of workbook "%s"\n' % (
+                    _cr2a(c1 + k, r1 + f, c1 + k, r1 + l), self.sheet.name, self.sheet.workbook.name)
+            if len(instr) > 0:
+                _asrun(instr)
         if outline_string is not None:
             boundaries=_df2outline(pdobj,outline_string)
             self.outline(boundaries)
@@ -1217,6 +1263,7 @@ class Workbook():
         self.name = None
         self.parent = None
         self.sheets = []
+        self.precision = None # default number of decimals floats are rounded to by from_pandas, None for full precision
 
         if parent is not None:
             self.parent=parent
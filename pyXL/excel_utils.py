@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from collections import namedtuple as _namedtuple
+
+_XL_MAXROWS = 2**20
+_XL_MAXCOLS = 2**14
 
 def _cr2a(c1, r1, c2=None, r2=None):
     """
     r1=1 c1=1 gives A1 etc.
     """
     assert r1>0 and c1>0, "negative coordinates not allowed!"
+    assert max(r1, r2 or 0) <= _XL_MAXROWS and max(c1, c2 or 0) <= _XL_MAXCOLS, \
+        "coordinates beyond excel limits (%i rows, %i columns), see the overflow parameter of from_pandas" % \
+        (_XL_MAXROWS, _XL_MAXCOLS)
     out=_n2x(c1)+str(r1)
     if c2 is not None:
         out +=':'+ _n2x(c2) + str(r2)
@@ -122,13 +129,45 @@ def _isnumeric(x):
     except (ValueError, TypeError):
         return False
 
-def _df_to_ll(df, header=True, index=True, index_label=None):
+def _sparse_mi_mask(idx):
+    """
+    for each row and level of a MultiIndex, True if the label has to be shown in a sparse layout, i.e. if the label,
+    or the label of any upper level, differs from the one of the previous row; computed from the level codes
+    :param idx: a MultiIndex (any other index gives an all-True mask)
+    :return: boolean array, nrows x nlevels
+    """
+    import numpy as np
+    if idx.nlevels == 1 or len(idx) == 0:
+        return np.ones((len(idx), idx.nlevels), dtype=bool)
+    codes = np.column_stack(idx.codes)
+    changed = np.ones(codes.shape, dtype=bool)
+    changed[1:] = codes[1:] != codes[:-1]
+    return np.logical_or.accumulate(changed, axis=1)
+
+def _sparse_mi_runs(mask):
+    """
+    rows spanned by each label of a sparse MultiIndex layout, i.e. the cells that can be merged
+    :param mask: boolean array as returned by _sparse_mi_mask
+    :return: list of (level, first row, last row), 0-based, only for labels spanning more than one row
+    """
+    import numpy as np
+    out = []
+    for k in range(mask.shape[1]):
+        starts = np.flatnonzero(mask[:, k])
+        ends = np.r_[starts[1:], mask.shape[0]] - 1
+        for f, l in zip(starts[ends > starts].tolist(), ends[ends > starts].tolist()):
+            out.append((k, f, l))
+    return out
+
+def _df_to_ll(df, header=True, index=True, index_label=None, sparse_mi=False):
     """
     transform DataFrame or Series object into a list of lists
     :param self:
     :param header: True/False
     :param index: True/False
     :param index_label: currently unused
+    :param sparse_mi: if True, MultiIndex labels are written only where they change; a mask as returned by
+                      _sparse_mi_mask may be given instead, eg when df is a chunk of a larger DataFrame
     :return:
     """
     if header:
@@ -146,6 +185,398 @@ def _df_to_ll(df, header=True, index=True, index_label=None):
 
     if index:
         vals=df.reset_index().values.tolist()
+        import numpy as np
+        if (isinstance(sparse_mi, np.ndarray) or sparse_mi) and df.index.nlevels > 1:
+            mask = sparse_mi if isinstance(sparse_mi, np.ndarray) else _sparse_mi_mask(df.index)
+            for i, k in zip(*np.nonzero(~mask)):
+                vals[i][k] = None
     else:
         vals=df.values.tolist()
     return hdr + vals
+
+def _df_to_cols(df, header=True, index=True, sparse_mi=False):
+    """
+    transform DataFrame or Series object into a list of header rows and a list of column arrays, so that data can be
+    stored and processed one column at a time instead of one cell at a time
+    empty cells (NaN, None, NaT, and the fill value of sparse columns) are dropped: such columns only keep their
+    non-empty values, along with the rows they belong to
+    :param df:
+    :param header: True/False
+    :param index: True/False
+    :param sparse_mi: if True, MultiIndex labels are kept only where they change, and dropped elsewhere
+    :return: header rows (list of lists), columns (list of numpy arrays, never sharing memory with df), rows (list
+             with, for each column, the 0-based rows of its values, or None if no value was dropped)
+    """
+    import pandas as pd
+    import numpy as np
+    if df.ndim == 1: df = df.to_frame()
+    hdr = _df_to_ll(pd.DataFrame(index=df.index[:0], columns=df.columns), header=header, index=index)
+    temp = df.reset_index() if index else df
+    cols, rows = [], []
+    for j in range(temp.shape[1]):
+        col = temp.iloc[:, j]
+        if isinstance(col.dtype, pd.SparseDtype):
+            # only the explicitly stored values are used, the fill value is never expanded
+            vals, idx = col.array.sp_values, col.array.sp_index.indices
+        else:
+            if col.dtype.kind == 'M' and getattr(col.dtype, 'tz', None) is not None:
+                # excel has no notion of timezone, the local wall time is kept
+                col = col.dt.tz_localize(None)
+            vals, idx = col.to_numpy(), None
+        keep = ~pd.isna(vals)
+        if index and sparse_mi and j < df.index.nlevels and df.index.nlevels > 1:
+            keep &= _sparse_mi_mask(df.index)[:, j]
+        if not keep.all():
+            vals = vals[keep]
+            idx = np.flatnonzero(keep) if idx is None else idx[keep]
+        else:
+            # the values may be a view of the DataFrame, which the caller may still change before the file is written
+            vals = np.array(vals, copy=True)
+        cols.append(vals)
+        rows.append(idx)
+    return hdr, cols, rows
+
+def _col_value(col, rows, i):
+    """
+    value of the i-th row of a column as returned by _df_to_cols, None if the cell is empty
+    :param col: array of values
+    :param rows: rows of the values, or None
+    :param i: row, 0-based
+    :return:
+    """
+    import numpy as np
+    if rows is None:
+        return col[i]
+    k = np.searchsorted(rows, i)
+    return col[k] if k < len(rows) and rows[k] == i else None
+
+def _densify(col, rows, n):
+    """
+    expand a column as returned by _df_to_cols to its full length, empty cells are NaN for numbers, NaT for datetimes
+    and None otherwise
+    :param col: array of values
+    :param rows: rows of the values, or None
+    :param n: number of rows
+    :return: numpy array of length n
+    """
+    import numpy as np
+    if rows is None:
+        return col
+    if col.dtype.kind in 'mM':
+        out = np.full(n, col.dtype.type('NaT'), dtype=col.dtype)
+    elif col.dtype.kind in 'iuf':
+        out = np.full(n, np.nan)
+    else:
+        out = np.full(n, None, dtype=object)
+    out[rows] = col
+    return out
+
+def _dt64_to_serial(arr, date_1904=False):
+    """
+    convert an array of datetime64 (or timedelta64) values to excel serial numbers in one vectorized operation
+    in the 1900 date system, excel counts the non-existent 1900-02-29, so dates from 1900-03-01 are shifted by one day
+    :param arr: numpy datetime64 or timedelta64 array, timezone naive
+    :param date_1904: True if the workbook uses the 1904 date system
+    :return: float array, NaN where arr is NaT
+    """
+    import numpy as np
+    if arr.dtype.kind == 'm':
+        return arr / np.timedelta64(1, 'D')
+    epoch = np.datetime64('1904-01-01' if date_1904 else '1899-12-31')
+    out = (arr - epoch) / np.timedelta64(1, 'D')
+    if not date_1904:
+        out[out >= 60] += 1 # serial 60 is the 1900-02-29 that Excel counts but does not exist
+    return out
+
+def _serial_to_dt64(arr, date_1904=False):
+    """
+    convert an array of excel serial numbers to datetime64 values in one vectorized operation, see _dt64_to_serial
+    :param arr: float array
+    :param date_1904: True if the workbook uses the 1904 date system
+    :return: datetime64[ms] array, NaT where arr is NaN
+    """
+    import numpy as np
+    arr = np.asarray(arr, dtype=float)
+    if not date_1904:
+        arr = np.where(arr > 60, arr - 1, arr)
+    epoch = np.datetime64('1904-01-01' if date_1904 else '1899-12-31', 'ms')
+    ms = np.round(arr * 86400000)
+    nan = np.isnan(ms)
+    out = epoch + np.where(nan, 0, ms).astype(np.int64).astype('m8[ms]')
+    out[nan] = np.datetime64('NaT')
+    return out
+
+def _to_objects(arr):
+    """
+    convert an array to python objects; datetimes and timedeltas become datetime.datetime and datetime.timedelta (None
+    for NaT) rather than integers
+    :param arr: numpy array
+    :return: object array
+    """
+    if arr.dtype.kind in 'mM':
+        arr = arr.astype(arr.dtype.kind + '8[us]')
+    return arr.astype(object)
+
+def _precision_digits(df, precision=None, default=None):
+    """
+    number of decimals each (non-index) column of df is rounded to before being written; only float columns are rounded
+    :param df: DataFrame or Series
+    :param precision: number of decimals for all float columns, or dict {column label: number of decimals}
+    :param default: number of decimals for float columns not found in precision (eg the workbook default), or None
+    :return: list with one number of decimals (or None) per column
+    """
+    import pandas as pd
+    if df.ndim == 1: df = df.to_frame()
+    if not isinstance(precision, dict):
+        precision, default = {}, precision if precision is not None else default
+    out = []
+    for label, dtype in zip(df.columns, df.dtypes):
+        digits = precision.get(label, default)
+        kind = dtype.subtype.kind if isinstance(dtype, pd.SparseDtype) else dtype.kind
+        out.append(digits if kind == 'f' else None)
+    return out
+
+def _round_frame(df, digits):
+    """
+    round the columns of a DataFrame in a vectorized way, without copying the columns that are left untouched
+    :param df: DataFrame or Series
+    :param digits: list with one number of decimals (or None) per column, as returned by _precision_digits
+    :return: DataFrame
+    """
+    import numpy as np
+    if df.ndim == 1: df = df.to_frame()
+    if all(d is None for d in digits):
+        return df
+    df = df.copy(deep=False)
+    for j, d in enumerate(digits):
+        if d is not None:
+            df.isetitem(j, np.round(df.iloc[:, j].to_numpy(dtype=float), d))
+    return df
+
+def _estimate_row_bytes(df, index=True, sample=1000):
+    """
+    estimated size of one row of df in the sheet xml, from a sample of evenly spaced rows: each cell takes about 30
+    bytes of markup on top of the text of its value
+    :param df: DataFrame or Series
+    :param index: True/False
+    :param sample: number of rows measured
+    :return: number of bytes
+    """
+    import numpy as np
+    if df.ndim == 1: df = df.to_frame()
+    if len(df) == 0:
+        return 1.
+    temp = df.iloc[np.linspace(0, len(df) - 1, min(sample, len(df))).astype(int)]
+    if index: temp = temp.reset_index()
+    chars = sum(temp.iloc[:, j].astype(str).str.len().mean() for j in range(temp.shape[1]))
+    return float(chars) + 30. * temp.shape[1] + 20.
+
+def _overflow_bounds(df, row=1, header=True, index=True, max_rows=None, max_bytes=None):
+    """
+    split the rows of df into chunks that fit on a sheet when written from the given row, with the header repeated
+    :param df: DataFrame or Series
+    :param row: top row of the destination, 1-based
+    :param header: True/False
+    :param index: True/False
+    :param max_rows: maximum number of data rows in a chunk, on top of the excel limit
+    :param max_bytes: maximum estimated size of the sheet xml of a chunk (an upper bound of the compressed file size)
+    :return: list of (first, last + 1) positional row bounds
+    """
+    nhdr = (df.columns.nlevels if df.ndim > 1 else 1) if header else 0
+    n = _XL_MAXROWS - row + 1 - nhdr
+    if max_rows is not None: n = min(n, max_rows)
+    if max_bytes is not None: n = min(n, int(max_bytes // _estimate_row_bytes(df, index=index)))
+    n = max(n, 1)
+    return [(a, min(a + n, len(df))) for a in range(0, len(df), n)] or [(0, 0)]
+
+def _split_overflow(rng, df, overflow, max_rows=None, max_bytes=None, **kwargs):
+    """
+    write a pandas object too large for a single sheet in chunks, each chunk being a slice of df (no copy) written by
+    from_pandas at the same address, with the header repeated:
+    - overflow='sheets': the first chunk goes to rng, the others to continuation sheets named "<sheet> (2)", ...
+    - overflow='files': the first chunk goes to rng, the others to continuation workbooks "<name>_2.xlsx", ...; each of
+      them is saved and closed as soon as its chunk is written, so that only one chunk is held at a time
+    :param rng: destination range
+    :param df: DataFrame or Series
+    :param overflow: 'sheets' or 'files'
+    :param max_rows: maximum number of data rows per sheet, on top of the excel limit
+    :param max_bytes: maximum estimated size of the sheet xml per sheet
+    :param kwargs: passed to from_pandas
+    :return: what from_pandas returns for the first chunk
+    """
+    import os
+    assert overflow in ('sheets', 'files'), "overflow must be 'sheets' or 'files'"
+    c1, r1 = _a2cr(rng.address, f4=True)[:2]
+    bounds = _overflow_bounds(df, r1, header=kwargs.get('header', True), index=kwargs.get('index', True),
+                              max_rows=max_rows, max_bytes=max_bytes)
+    out = rng.from_pandas(df.iloc[bounds[0][0]:bounds[0][1]], **kwargs)
+    wb = rng.sheet.workbook
+    for k, (a, b) in enumerate(bounds[1:], 2):
+        if overflow == 'sheets':
+            suffix = ' (%i)' % k
+            sheet = wb.create_sheet(rng.sheet.name[:31 - len(suffix)] + suffix)
+            sheet.arng(_cr2a(c1, r1)).from_pandas(df.iloc[a:b], **kwargs)
+        else:
+            root, ext = os.path.splitext(getattr(wb, 'path', None) or wb.name)
+            path = '%s_%i%s' % (root, k, ext or '.xlsx')
+            cont = wb.parent.create_wb(name=path)
+            cont.sheets[0].arng(_cr2a(c1, r1)).from_pandas(df.iloc[a:b], **kwargs)
+            cont.saveas(path)
+            cont.close()
+    return out
+
+_DTYPE_FORMATS = {'date': 'yyyy-mm-dd', 'datetime': 'yyyy-mm-dd hh:mm:ss', 'timedelta': '[h]:mm:ss',
+                  'float': 2, 'int': '0', 'bool': None, 'category': None, 'object': None}
+
+def _dtype_formats(df, index=True, policy=True):
+    """
+    excel number format of each column written by from_pandas (index columns first), according to its dtype
+    datetime columns whose values are all at midnight use the 'date' format
+    :param df: DataFrame or Series
+    :param index: True/False
+    :param policy: True for the default policy (see _DTYPE_FORMATS), or a dict overriding some of its keys
+                   ('date', 'datetime', 'timedelta', 'float', 'int', 'bool', 'category', 'object'); the float format
+                   may also be given as a number of decimals
+    :return: list with one format string (or None) per column
+    """
+    import pandas as pd
+    if policy is True: policy = {}
+    policy = dict(_DTYPE_FORMATS, **policy)
+    if df.ndim == 1: df = df.to_frame()
+    cols = [df.index.get_level_values(i) for i in range(df.index.nlevels)] if index else []
+    cols += [df.iloc[:, j] for j in range(df.shape[1])]
+    out = []
+    for col in cols:
+        dtype = col.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            kind = 'category'
+        elif dtype.kind == 'b':
+            kind = 'bool'
+        elif dtype.kind == 'M':
+            s = pd.Series(col)
+            kind = 'date' if (s.dt.normalize() == s).all() else 'datetime'
+        elif dtype.kind == 'm':
+            kind = 'timedelta'
+        elif dtype.kind == 'f':
+            kind = 'float'
+        elif dtype.kind in 'iu':
+            kind = 'int'
+        else:
+            kind = 'object'
+        fmt = policy[kind]
+        if kind == 'float' and isinstance(fmt, int):
+            fmt = '#,##0' + ('.' + '0' * fmt if fmt > 0 else '')
+        out.append(fmt)
+    return out
+
+# placeholders of the arrays and DataFrames copied into shared memory by _share_arrays
+_SharedArray = _namedtuple('_SharedArray', 'offset dtype shape')
+_SharedFrame = _namedtuple('_SharedFrame', 'columns index values')
+
+def _share_arrays(obj):
+    """
+    copy the numeric, boolean and datetime numpy arrays found in obj, possibly nested in dicts, lists, tuples and
+    DataFrames, into a single shared memory segment, so that obj can be sent to another process without pickling them
+    other columns of DataFrames (strings, categoricals...) are left to pickle
+    :param obj:
+    :return: (SharedMemory or None, obj with the arrays replaced by placeholders), see _attach_arrays; the caller
+             closes and unlinks the segment once the other process is done with it
+    """
+    import numpy as np
+    import pandas as pd
+    from multiprocessing import shared_memory
+    arrays, size = [], 0
+    def share(x):
+        nonlocal size
+        if isinstance(x, np.ndarray) and x.dtype.kind in 'iufbmM':
+            arrays.append((size, x))
+            ref = _SharedArray(size, x.dtype.str, x.shape)
+            size += -(-x.nbytes // 8) * 8
+            return ref
+        if isinstance(x, pd.DataFrame):
+            values = []
+            for j in range(x.shape[1]):
+                col = x.iloc[:, j]
+                plain = isinstance(col.dtype, np.dtype) and col.dtype.kind in 'iufbmM'
+                values.append(share(col.to_numpy()) if plain else col.array)
+            return _SharedFrame(x.columns, x.index, values)
+        if isinstance(x, dict):
+            return {k: share(v) for k, v in x.items()}
+        if type(x) in (list, tuple):
+            return type(x)(share(v) for v in x)
+        return x
+    obj = share(obj)
+    shm = None
+    if size:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        for offset, a in arrays:
+            np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf, offset=offset)[...] = a
+    return shm, obj
+
+def _attach_arrays(obj, buf, copy=False):
+    """
+    rebuild an object sent by another process with _share_arrays
+    :param obj: object with placeholders
+    :param buf: buffer of the shared memory segment, or None if there was none
+    :param copy: if False, arrays are views of the segment, which must stay open as long as they are used; DataFrames
+                 are always copied
+    :return:
+    """
+    import numpy as np
+    import pandas as pd
+    def attach(x):
+        if isinstance(x, _SharedArray):
+            if buf is None:
+                return np.empty(x.shape, dtype=x.dtype)
+            a = np.ndarray(x.shape, dtype=x.dtype, buffer=buf, offset=x.offset)
+            return a.copy() if copy else a
+        if isinstance(x, _SharedFrame):
+            values = [attach(v) for v in x.values]
+            df = pd.DataFrame(dict(enumerate(values)), index=x.index, copy=True)
+            df.columns = x.columns
+            return df
+        if isinstance(x, dict):
+            return {k: attach(v) for k, v in x.items()}
+        if type(x) in (list, tuple):
+            return type(x)(attach(v) for v in x)
+        return x
+    return attach(obj)
+
+def _hash_update(h, obj):
+    """
+    feed a stable representation of obj to a hashlib object, recursing into dicts, lists and tuples; numpy arrays of
+    numbers, dates and fixed width strings are hashed as raw bytes and string arrays with pandas' vectorized hash,
+    other values by type and repr, so that objects without a stable repr only make hashes differ
+    :param h: hashlib object
+    :param obj:
+    :return:
+    """
+    import numpy as np
+    import pandas as pd
+    if isinstance(obj, dict):
+        h.update(b'{%i' % len(obj))
+        for k, v in obj.items():
+            _hash_update(h, k)
+            _hash_update(h, v)
+    elif type(obj) in (list, tuple):
+        h.update(b'[%i' % len(obj))
+        for v in obj:
+            _hash_update(h, v)
+    elif isinstance(obj, pd.Categorical):
+        h.update(b'categorical')
+        _hash_update(h, obj.codes)
+        _hash_update(h, obj.categories.to_numpy())
+    elif isinstance(obj, (np.ndarray, pd.api.extensions.ExtensionArray)):
+        arr = np.asarray(obj)
+        h.update(('array %s %r' % (arr.dtype.str, arr.shape)).encode())
+        if arr.dtype.kind in 'iufbmMUS':
+            h.update(np.ascontiguousarray(arr).view(np.uint8))
+        elif pd.api.types.infer_dtype(arr, skipna=False) == 'string':
+            h.update(pd.util.hash_array(arr.ravel()))
+        else:
+            _hash_update(h, arr.ravel().tolist())
+    elif isinstance(obj, (bytes, bytearray)):
+        h.update(b'bytes %i:' % len(obj))
+        h.update(obj)
+    else:
+        h.update(('%s %r;' % (type(obj).__name__, obj)).encode())
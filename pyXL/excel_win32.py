@@ -14,7 +14,9 @@ import pytz as _pytz
 import numpy as _np
 from copy import copy as _copy
 
-from pyXL.excel_utils import _cr2a, _a2cr, _n2x, _x2n, _splitaddr, _df2outline, _isnumeric,_df_to_ll
+from pyXL.excel_utils import _cr2a, _a2cr, _n2x, _x2n, _splitaddr, _df2outline, _isnumeric,_df_to_ll, _dtype_formats, \
+    _sparse_mi_mask, _sparse_mi_runs, _precision_digits, _round_frame, \
+    _split_overflow
 
 
 class Rng:
@@ -330,7 +332,8 @@ class Rng:
         temp = self.range.Cells()
         return [x.GetAddress(0,0) for x in temp]
 
-    def from_pandas(self, pdobj, header=True, index=True, index_label=None, outline_string=None):
+    def from_pandas(self, pdobj, header=True, index=True, index_label=None, outline_string=None, dtype_fmt=None,
+                    sparse_mi=False, precision=None, overflow=None, max_rows=None, max_bytes=None):
         """
                 write a pandas object to excel
         :param pdobj: any DataFrame or Series object
@@ -339,14 +342,38 @@ class Rng:
         :param index: if False, strip index
         :param index_label: index header
         :param outline_string: a string used to identify outline main levels (eg " All")
+        :param dtype_fmt: if True, number formats are set on each column according to its dtype
+                          (see excel_utils._DTYPE_FORMATS), a dict may be used to override the default formats
+        :param sparse_mi: if True, MultiIndex labels are written only where they change; if 'merge', the cells spanned
+                          by each label are also merged
+        :param precision: number of decimals floats are rounded to before being written, either for all float columns
+                          or as a dict {column label: number of decimals}; defaults to the precision of the workbook
+        :param overflow: if 'sheets' or 'files', a frame that does not fit below the range (or exceeds max_rows or
+                         max_bytes) is split across continuation sheets or workbooks, see excel_utils._split_overflow
+        :param max_rows: maximum number of data rows per sheet when overflow is set
+        :param max_bytes: maximum estimated size of the sheet data per sheet when overflow is set
         :return:
         """
-        temp = _df_to_ll(pdobj,header=header, index=index)
+        if overflow is not None:
+            return _split_overflow(self, pdobj, overflow, max_rows, max_bytes, header=header, index=index,
+                                   index_label=index_label, outline_string=outline_string, dtype_fmt=dtype_fmt,
+                                   sparse_mi=sparse_mi, precision=precision)
+        pdobj = _round_frame(pdobj, _precision_digits(pdobj, precision, self.sheet.workbook.precision))
+        temp = _df_to_ll(pdobj,header=header, index=index, sparse_mi=sparse_mi)
         temp = _fix_4_win(temp)
         trange = self.resize(len(temp), len(temp[0]))
         trange.range.Value=temp
         self.address = trange.address
         self.range = self.sheet.ws.Range(self.address)
+        if dtype_fmt:
+            for j, fmt in enumerate(_dtype_formats(pdobj, index=index, policy=dtype_fmt)):
+                if fmt is not None:
+                    self.range.Columns[j + 1].NumberFormat = fmt
+        if sparse_mi == 'merge' and index:
+            c1, r1 = _a2cr(self.address, f4=True)[:2]
+            r1 += len(temp) - len(pdobj)
+            for k, f, l in _sparse_mi_runs(_sparse_mi_mask(pdobj.index)):
+                self.sheet.ws.Range(_cr2a(c1 + k, r1 + f, c1 + k, r1 + l)).Merge()
         if outline_string is not None:
             boundaries = _df2outline(pdobj, outline_string)
             self.outline(boundaries)
@@ -878,6 +905,7 @@ class Workbook():
         self.parent = None
         self.sheets = []
         self.existing_wb = existing
+        self.precision = None # default number of decimals floats are rounded to by from_pandas, None for full precision
 
         if parent is not None:
             self.parent = parent
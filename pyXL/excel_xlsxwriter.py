@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import xlsxwriter as XLW
+from xlsxwriter.utility import quote_sheetname as _quote_sheetname
+from xlsxwriter.packager import Packager as _Packager
 """
 :mod:`excel_mac_as` -- Excel-Applescript wrapper
 ================================================
@@ -15,15 +17,29 @@ TODO:
 * investigate applescript colorscale bug
 * range intersection
 * range union
-* create excel charts
 
 """
 import pandas as _pd
 import os as _os
+import io as _io
+import zlib as _zlib
+import zipfile as _zipfile
+import collections as _collections
+import hashlib as _hashlib
+import shutil as _shutil
+import tempfile as _tempfile
+import struct as _struct
+import time as _time
+import threading as _threading
+import concurrent.futures as _futures
 import numpy as _np
-from copy import copy as _copy
+from copy import copy as _copy, deepcopy as _deepcopy
 
-from pyXL.excel_utils import _cr2a, _a2cr, _n2x, _x2n, _splitaddr, _df2outline, _isrow, _iscol, _isnumeric,_df_to_ll
+import re as _re
+from pyXL.excel_utils import _cr2a, _a2cr, _n2x, _x2n, _splitaddr, _df2outline, _isrow, _iscol, _isnumeric,_df_to_ll, \
+    _df_to_cols, _dtype_formats, _sparse_mi_mask, _sparse_mi_runs, _dt64_to_serial, \
+    _col_value, _densify, _precision_digits, \
+    _split_overflow, _hash_update, _to_objects
 
 class Rng:
     """
@@ -297,16 +313,20 @@ class Rng:
                 return self.from_pandas(temp, header=False, index=False)
             self.sheet.cell_data[self.address]=v
         else:
-            pass
+            out = self.get_array()
+            return out[0][0] if len(out) == 1 and len(out[0]) == 1 else out
 
     def get_array(self, string_value=False):
         """
-        get an excel range as a list of lists
-
-        currently has problems with strings containing the { or } characters
+        get an excel range as a list of lists, empty cells being None
+        values are those stored in the sheet or, for workbooks opened with Excel.open_wb, read from the file; entire
+        rows and columns are cut at the last cell holding a value
+        :param string_value: not supported, values are returned as they are
         :return: list
         """
-        pass
+        c1, r1, c2, r2 = _a2cr(self.address, f4=True)
+        cols = self.sheet._get_columns(c1, r1, c2, r2, trim=_isrow(self.address) or _iscol(self.address))
+        return [list(row) for row in zip(*[col.tolist() for col in cols])]
 
     def get_df(self, index=0, header=0):
         """
@@ -359,10 +379,13 @@ class Rng:
         """
         pass
 
-    def from_pandas(self, pdobj, header=True, index=True, index_label=None, outline_string=None):
+    def from_pandas(self, pdobj, header=True, index=True, index_label=None, outline_string=None, as_table=False,
+                    style=None, dtype_fmt=None, sparse_mi=False, precision=None, overflow=None, max_rows=None,
+                    max_bytes=None):
         """
                 write a pandas object to excel via clipboard
-        :param pdobj: any DataFrame or Series object
+        empty cells (NaN, None, NaT) are not written at all; for sparse objects, only the stored values are written
+        :param pdobj: any DataFrame or Series object, or a scipy.sparse matrix
 
         see DataFrame.to_clipboard? for info on params below
 
@@ -370,16 +393,51 @@ class Rng:
         :param index: if False, strip index
         :param index_label: index header
         :param outline_string: a string used to identify outline main levels (eg " All")
+        :param as_table: if True, the range is written as an excel table, whose style takes care of header format,
+                         autofilter and banding; requires a single header row
+        :param style: name of the table style, eg 'Table Style Light 9', if None the excel default is used
+        :param dtype_fmt: if True, number formats are set on entire columns according to the dtype of each column
+                          (see excel_utils._DTYPE_FORMATS), a dict may be used to override the default formats
+        :param sparse_mi: if True, MultiIndex labels are written only where they change; if 'merge', the cells spanned
+                          by each label are also merged
+        :param precision: number of decimals floats are rounded to before being written, either for all float columns
+                          or as a dict {column label: number of decimals}; defaults to the precision of the workbook
+        :param overflow: if 'sheets' or 'files', a frame that does not fit below the range (or exceeds max_rows or
+                         max_bytes) is split across continuation sheets or workbooks, see excel_utils._split_overflow
+        :param max_rows: maximum number of data rows per sheet when overflow is set
+        :param max_bytes: maximum estimated size of the sheet data per sheet when overflow is set
         :return:
         """
 
-        temp=_df_to_ll(pdobj,header=header,index=index)
-        trange = self.resize(len(temp), len(temp[0]))
-        coords=_a2cr(trange.address)
-        for j,c in enumerate(range(coords[0],coords[2]+1)):
-            for i,r in enumerate(range(coords[1], coords[3] + 1)):
-                addr=_cr2a(c,r)
-                self.sheet.cell_data[addr] = temp[i][j]
+        if hasattr(pdobj, 'tocsc'):
+            pdobj = _pd.DataFrame.sparse.from_spmatrix(pdobj)
+        if overflow is not None:
+            return _split_overflow(self, pdobj, overflow, max_rows, max_bytes, header=header, index=index,
+                                   index_label=index_label, outline_string=outline_string, dtype_fmt=dtype_fmt,
+                                   sparse_mi=sparse_mi, precision=precision, as_table=as_table, style=style)
+        hdr, cols, rows = _df_to_cols(pdobj, header=header, index=index, sparse_mi=sparse_mi)
+        digits = _precision_digits(pdobj, precision, self.sheet.workbook.precision)
+        for j, d in enumerate(digits, len(cols) - len(digits)):
+            if d is not None:
+                cols[j] = _np.round(cols[j], d)
+        trange = self.resize(len(hdr) + pdobj.shape[0], len(cols))
+        self.sheet._store_block(trange.address, hdr, cols, rows)
+        if sparse_mi == 'merge' and index:
+            c1, r1 = _a2cr(trange.address, f4=True)[:2]
+            r1 += len(hdr)
+            for k, f, l in _sparse_mi_runs(_sparse_mi_mask(pdobj.index)):
+                self.sheet.merges.append([_cr2a(c1 + k, r1 + f, c1 + k, r1 + l), pdobj.index.get_level_values(k)[f]])
+        if as_table:
+            assert len(hdr) == 1, "tables require exactly one header row"
+            options = {'columns': [{'header': str(h)} for h in hdr[0]]}
+            if style is not None: options['style'] = style
+            self.sheet.tables.append([trange.address, options])
+        if dtype_fmt:
+            c1 = _a2cr(trange.address, f4=True)[0]
+            for j, fmt in enumerate(_dtype_formats(pdobj, index=index, policy=dtype_fmt)):
+                if fmt is not None:
+                    col = _n2x(c1 + j)
+                    self.sheet.cell_formats.setdefault('%s:%s' % (col, col), {})['num_format'] = fmt
 
         self.address = trange.address
         if outline_string is not None:
@@ -389,16 +447,25 @@ class Rng:
 
     def to_pandas(self, index=1, header=1):
         """
-        read excel data into a pandas object via clipboard
-
-        WARNING: data will be read from the excel sheet "as-is", so format them correctly beforehand!!!!
-
-        :param index_col: if None, do not reat index, else use first index_col columns
-        :param header: if None, do not read header, esel use first row
-        :param parse_dates: parse date columns
+        return a range as dataframe, see get_array
+        columns only holding numbers (or dates) are read as float (or datetime64) arrays in one vectorized operation
+        :param index: None for no index, otherwise an integer specifying first n columns to use as index
+        :param header: None to avoid using columns, any other value to use first n rows as column header
         :return: a DataFrame object
         """
-        pass
+        c1, r1, c2, r2 = _a2cr(self.address, f4=True)
+        n = 0 if header is None else header
+        cols = self.sheet._get_columns(c1, r1 + n, c2, r2, typed=True,
+                                       trim=_isrow(self.address) or _iscol(self.address))
+        hdr = self.sheet._get_columns(c1, r1, c1 + len(cols) - 1, r1 + n - 1) if n else []
+        temp = _pd.DataFrame(dict(enumerate(cols))).infer_objects()
+        if n == 1:
+            temp.columns = [col[0] for col in hdr]
+        elif n > 1:
+            temp.columns = _pd.MultiIndex.from_arrays([[col[i] for col in hdr] for i in range(n)])
+        if index:
+            temp = temp.set_index(temp.columns.tolist()[:index])
+        return temp
 
     def clear_formats(self):
         """
@@ -438,9 +505,9 @@ class Rng:
         :param w: width
         :return:
         """
-        c1,r1,c2,r2=_a2cr(self.address)
-        self.parent.ws.set_column(c1-1,c2-1,width=w)
-        #self.sheet.workbook.parent.set_column(c1-1,c2-1,width=w)
+        c1,r1,c2,r2=_a2cr(self.address, f4=True)
+        for c in range(c1, c2+1):
+            self.sheet.col_widths[c] = w
 
     def row_height(self, h):
         """
@@ -448,15 +515,16 @@ class Rng:
         :param h: height
         :return:
         """
-        c1,r1,c2,r2=_a2cr(self.address)
-        self.parent.ws.set_column(r1-1,height=h)
+        c1,r1,c2,r2=_a2cr(self.address, f4=True)
+        for r in range(r1, r2+1):
+            self.sheet.row_heights[r] = h
 
     def curr_region(self):
         """
         get range of the current region
         :return: new range object
         """
-        curr=_get_contiguous(self.address,self.sheet.cell_data.keys())
+        curr=_get_contiguous(self.address,list(self.sheet.cell_data.keys())+list(self.sheet.blocks.keys()))
         return Rng(address=curr, sheet=self.sheet)
 
     def replace(self, val, repl_with, whole=False):
@@ -485,8 +553,9 @@ class Rng:
 
     def format_range(self, fmt_dict={}, cw_dict={}, columns=True):
         """
-        TODO
         formats multiple columns (or rows) at once
+        column names are taken from the stored data, and formats are applied to entire columns (rows) of the sheet,
+        so that a single format is stored per column instead of one per cell
         :param fmt_dict: dictionary where keys are column headers of the range (i.e. strings in the first row) while
                          values are excel formatting codes
                          fmt_dict keys may also be regular expressions which are then matched against column names
@@ -495,7 +564,26 @@ class Rng:
         :param columns: if True iterate over columns, else over rows
         :return:
         """
-        pass
+        c1, r1, c2, r2 = _a2cr(self.address, f4=True)
+        if columns:
+            names = [str(nm) for nm in self.sheet._get_values(c1, r1, c2, r1)[0]]
+            first, addr = c1, lambda i: '%s:%s' % (_n2x(i), _n2x(i))
+            sizes = self.sheet.col_widths
+        else:
+            names = [str(nm[0]) for nm in self.sheet._get_values(c1, r1, c1, r2)]
+            first, addr = r1, lambda i: '%i:%i' % (i, i)
+            sizes = self.sheet.row_heights
+
+        for k, v in fmt_dict.items():
+            matcher = _re.compile(k)
+            for i, nm in enumerate(names):
+                if matcher.search(nm) is not None:
+                    self.sheet.cell_formats.setdefault(addr(first+i), {})['num_format'] = v
+        for k, v in cw_dict.items():
+            matcher = _re.compile(k)
+            for i, nm in enumerate(names):
+                if matcher.search(nm) is not None:
+                    sizes[first+i] = v
 
 
     def freeze_panes(self):
@@ -503,15 +591,13 @@ class Rng:
         freezes panes at upper left cell of range
         :return:
         """
-        c,r=_a2cr(self.address)
-        self.parent.ws.freeze_panes(r-1,c-1)
+        c, r = _a2cr(self.address, f4=True)[:2]
+        self.sheet.panes = (r - 1, c - 1)
 
-    def color_scale(self, vmin=5, vmed=50, vmax=95, cv=5):
+    def color_scale(self, vmin=5, vmed=50, vmax=95, cv=5, invert_colors=False):
         """
-        TODO
         apply 3 color scale formatting
-        NOTE: THIS ONLY WORKS IF CP.XLAM ADDIN IS LOADED IN EXCEL!!!! as applescript handling of advanced
-            conditional formatting is apparently broken
+        a single conditional format rule is stored for the whole range, so no per-cell formats are created
 
         :param vmin: minimum value
         :param vmed: median value
@@ -526,9 +612,51 @@ class Rng:
             -1 No conditional value.
             0 Number is used.
             3 Percentage is used.
+        :param invert_colors: if True, lowest values are green and highest are red
         :return:
         """
-        pass
+        colors = ['#F8696B', '#FFEB84', '#63BE7B']
+        if invert_colors: colors = colors[::-1]
+        types = {5: 'percentile', 0: 'num', 3: 'percent', 4: 'formula'}
+        options = {'type': '3_color_scale',
+                   'min_color': colors[0], 'mid_color': colors[1], 'max_color': colors[2]}
+        if cv in types:
+            options.update({'min_type': types[cv], 'min_value': vmin,
+                            'mid_type': types[cv], 'mid_value': vmed,
+                            'max_type': types[cv], 'max_value': vmax})
+        else:
+            options.update({'min_type': 'min', 'mid_type': 'percentile', 'mid_value': 50, 'max_type': 'max'})
+        self.sheet.cond_formats.append([self.address, options])
+
+    def data_bars(self, color=(99, 142, 198), vmin=None, vmax=None):
+        """
+        apply data bar formatting
+        :param color: RGB triplet of the bars
+        :param vmin: value corresponding to the shortest bar, if None the minimum of the range is used
+        :param vmax: value corresponding to the longest bar, if None the maximum of the range is used
+        :return:
+        """
+        options = {'type': 'data_bar', 'bar_color': _rgb2xlcol(color)}
+        if vmin is not None:
+            options.update({'min_type': 'num', 'min_value': vmin})
+        if vmax is not None:
+            options.update({'max_type': 'num', 'max_value': vmax})
+        self.sheet.cond_formats.append([self.address, options])
+
+    def banding(self, color=(242, 242, 242), columns=False):
+        """
+        color every other row (column) of the range, expressed as a single formula rule
+        :param color: RGB triplet used for the banded rows (columns)
+        :param columns: if True band columns instead of rows
+        :return:
+        """
+        c1, r1 = _a2cr(self.address, f4=True)[:2]
+        if columns:
+            criteria = '=MOD(COLUMN()-%i,2)=1' % c1
+        else:
+            criteria = '=MOD(ROW()-%i,2)=1' % r1
+        options = {'type': 'formula', 'criteria': criteria, 'format': {'bg_color': _rgb2xlcol(color)}}
+        self.sheet.cond_formats.append([self.address, options])
 
     def select(self):
         """
@@ -539,14 +667,18 @@ class Rng:
 
     def highlight(self, condition='==', threshold=0.0, interiorcolor=(255, 0, 0)):
         """
-        TODO
         highlight cells satisfying given condition
+        as in the other engines, any conditional format previously set on the same range is removed
         :param condition: one of ==,!=,>,<,>=,<=
         :param threshold: a number
         :param interiorcolor: an RGB triple specifying the color, eg [255,0,0] is red
         :return:
         """
-        pass
+        assert condition in ('==', '!=', '>', '<', '>=', '<='), "unknown condition %s" % condition
+        self.sheet.cond_formats = [cf for cf in self.sheet.cond_formats if cf[0] != self.address]
+        options = {'type': 'cell', 'criteria': condition, 'value': threshold,
+                   'format': {'bg_color': _rgb2xlcol(interiorcolor)}}
+        self.sheet.cond_formats.append([self.address, options])
 
     def col_dict(self):
         """
@@ -560,16 +692,38 @@ class Rng:
     def autofit_rows(self):
         """
         autofit row height
+        heights are estimated from the number of lines of the text stored in each row, rows with a single line are
+        left at the default height
         :return:
         """
-        pass
-
-    def autofit_cols(self):
+        c1, r1, c2, r2 = _a2cr(self.address, f4=True)
+        lines = _np.ones(r2 - r1 + 1, dtype=int)
+        for c in range(c1, c2 + 1):
+            for r, arr in self.sheet._get_column(c, r1, r2):
+                if arr.dtype.kind in 'OUS':
+                    n = _pd.Series(arr, dtype=object).str.count('\n').fillna(0).to_numpy(dtype=int) + 1
+                    seg = lines[r - r1:r - r1 + len(arr)]
+                    _np.maximum(seg, n, out=seg)
+        for r in [r for r in self.sheet.row_heights if r1 <= r <= r2]:
+            del self.sheet.row_heights[r]
+        for i in _np.flatnonzero(lines > 1).tolist():
+            self.sheet.row_heights[r1 + i] = 15 * int(lines[i])
+
+    def autofit_cols(self, budget=10000):
         """
         autofit column width
+        widths are estimated from the stored data: numeric columns are measured from their extreme values and their
+        number format, text columns from the length of their strings; columns taller than budget are measured on a
+        stratified sample of budget rows
+        :param budget: maximum number of text cells measured per column
         :return:
         """
-        pass
+        c1, r1, c2, r2 = _a2cr(self.address, f4=True)
+        for c in range(c1, c2 + 1):
+            fmt = self.sheet.cell_formats.get('%s:%s' % (_n2x(c), _n2x(c)), {}).get('num_format')
+            chars = max([_estimate_width(arr, fmt, budget) for r, arr in self.sheet._get_column(c, r1, r2)] + [0])
+            if chars > 0:
+                self.sheet.col_widths[c] = min(chars + 2, 255)
 
     def entire_row(self):
         """
@@ -608,33 +762,26 @@ class Rng:
 
     def outline(self, boundaries):
         """
-        TODO
         group rows as defined by boundaries object
+        levels are stored as runs of rows on the sheet, so memory is proportional to the number of groups
         :param boundaries: dictionary, where keys are group "main level" and values is a list of two
                            identifying subrows referring to main level
         :return:
         """
-        import six
         top=2**20
         lvl=0
-        for k,[f, l] in six.iteritems(boundaries):
+        groups=[]
+        for k,[f, l] in boundaries.items():
             if l<top:
                 top=l # this only works if boundaries are correctly sorted
                 lvl+=1
             r=self.offset(r=k).resize(r=l-k).entire_row()
             coords = _a2cr(r.address)
-            for row in range(coords[1], coords[3] + 1): # if I don't handle each row separately levels get overwritten!
-                addr='%i:%i'%(row,row)
-                if addr not in self.sheet.cell_options.keys(): self.sheet.cell_options[addr] = {}
-                if 'level' in self.sheet.cell_options[addr].keys():
-                    lvl=max(lvl,self.sheet.cell_options[addr]['level'])
-                self.sheet.cell_options[addr]['level']=lvl
-                if lvl>2:
-                    self.sheet.cell_options[addr]['collapsed']=True
-                elif lvl==2:
-                    self.sheet.cell_options[addr]['hidden'] = True
+            groups.append((coords[1], coords[3], lvl))
             r=self.offset(r=k-1).row(1)
             r.font_format(bold=True)
+        if len(groups) > 0:
+            self.sheet._set_outline(*zip(*groups))
 
     def show_levels(self, n=2):
         """
@@ -659,12 +806,82 @@ class Rng:
         paste a figure from a file onto an excel sheet, setting width and height as specified
         location will be the top left corner of the current range
 
-        :param figpath: posix path of file
+        matplotlib figures are rendered to png in memory on a background thread while the rest of the workbook is
+        built, so they should not be modified until the workbook is closed; identical images are stored only once
+
+        :param figpath: posix path of file, a matplotlib Figure, or the image content as bytes or BytesIO
         :param w: width in pixels
         :param h: height in pixels
         :return:
         """
-        self.sheet.images[self.address]=figpath
+        if hasattr(figpath, 'savefig'):
+            figpath = _render_pool().submit(_render_fig, figpath)
+        elif isinstance(figpath, (bytes, bytearray)):
+            figpath = bytes(figpath)
+        elif isinstance(figpath, _io.BytesIO):
+            figpath = figpath.getvalue()
+        self.sheet.images[self.address]=(figpath, w, h)
+
+    def chart(self, kind='line', series=None, categories=None, anchor=None, title=None, subtype=None, w=480, h=288):
+        """
+        create a native excel chart from the data of a range with a header row
+        the chart references the cells of the sheet, so no image needs to be rendered or embedded
+        :param kind: area, bar, column, line, pie, doughnut, scatter, stock or radar
+        :param series: list of column headers of the range, or Rng objects, to be plotted; if None all columns but the
+                       first are plotted
+        :param categories: column header or Rng object with the categories (x values); if None the first column of
+                           the range is used
+        :param anchor: address or Rng object of the top left cell of the chart; if None the chart is placed on the right
+                       of the range
+        :param title: chart title
+        :param subtype: chart subtype, eg stacked or percent_stacked, see xlsxwriter docs
+        :param w: width in pixels
+        :param h: height in pixels
+        :return:
+        """
+        c1, r1, c2, r2 = _a2cr(self.address, f4=True)
+        names = [str(nm) for nm in self.sheet._get_values(c1, r1, c2, r1)[0]]
+
+        def _ref(item):
+            # [sheet, first_row, first_col, last_row, last_col] 0-based, name cell is the header above the data
+            if isinstance(item, Rng):
+                cc = _a2cr(item.address, f4=True)
+                return item.sheet.name, [cc[1] - 1, cc[0] - 1, cc[3] - 1, cc[2] - 1], None
+            c = c1 + names.index(str(item))
+            return self.sheet.name, [r1, c - 1, r2 - 1, c - 1], [self.sheet.name, r1 - 1, c - 1]
+
+        if categories is None: categories = names[0]
+        if series is None: series = names[1:]
+        cname, cref, _ = _ref(categories)
+        chart = {'type': kind, 'subtype': subtype, 'title': title, 'size': {'width': w, 'height': h}, 'series': []}
+        for item in series:
+            sname, sref, name = _ref(item)
+            options = {'categories': [cname] + cref, 'values': [sname] + sref}
+            if name is not None: options['name'] = name
+            chart['series'].append(options)
+        if anchor is None:
+            anchor = _cr2a(c2 + 2, r1)
+        elif isinstance(anchor, Rng):
+            anchor = anchor.address
+        self.sheet.charts.append([anchor.split(':')[0], chart])
+
+    def sparklines(self, data_rng, kind='line', **kwargs):
+        """
+        add an in-cell sparkline to each row of the current range (a single column), plotting the corresponding row of
+        data_rng; all sparklines are registered as a single group, so no images are needed
+        :param data_rng: Rng object with the data, one row per sparkline
+        :param kind: line, column or win_loss
+        :param kwargs: any other sparkline option supported by xlsxwriter, eg markers=True, series_color='#E965E0'
+        :return:
+        """
+        c1, r1 = _a2cr(self.address, f4=True)[:2]
+        dc1, dr1, dc2, dr2 = _a2cr(data_rng.address, f4=True)
+        rows = _np.arange(dr1, dr2 + 1).astype(str)
+        locs = _np.arange(r1, r1 + len(rows)).astype(str)
+        prefix = '' if data_rng.sheet is self.sheet else _quote_sheetname(data_rng.sheet.name) + '!'
+        ranges = _np.char.add(_np.char.add(prefix + _n2x(dc1), rows), _np.char.add(':' + _n2x(dc2), rows))
+        options = dict(kwargs, type=kind, location=_np.char.add(_n2x(c1), locs), range=ranges)
+        self.sheet.sparklines.append(options)
 
     def subrng(self, t, l, nr=1, nc=1):
         """
@@ -727,11 +944,12 @@ class Excel():
 
     def active_workbook(self):
         """
-        return the active workbook
+        return the active workbook, that is the last one created or opened
         :return:
         """
-        raise Exception('xlsxwriter does not support editing existing files')
-        #return self.workbooks[self.awb]
+        if len(self.workbooks) == 0:
+            raise Exception('there is no open workbook')
+        return self.workbooks[-1]
 
     def active_range(self):
         """
@@ -776,10 +994,16 @@ class Excel():
     def open_wb(self, fpath):
         """
         open a workbook given its path
+        xlsxwriter cannot edit existing files: the workbook is opened by the fastxml engine in patch mode, values written
+        to its sheets replacing those in the file when it is closed, with only the sheets written to being rewritten
+        (see excel_fastxml.Workbook.close)
         :param fpath:
         :return:
         """
-        raise Exception("xlsxwriter does not allow working with existing files")
+        from pyXL.excel_fastxml import Workbook as _PatchWorkbook
+        wb = _PatchWorkbook(parent=self, name=fpath)
+        wb._open(fpath)
+        return wb
 
 class Workbook():
     """
@@ -800,6 +1024,15 @@ class Workbook():
         self.parent = None
         self.sheets = []
         self.path=name
+        self.date_format = 'yyyy-mm-dd' # shared by all dates written without a number format
+        self.precision = None # default number of decimals floats are rounded to by from_pandas, None for full precision
+        self.in_memory = False # if True, the parts of the xlsx file are assembled in memory instead of temporary files,
+                               # unless the file is streamed (see close)
+        self.tmpdir = None # directory of the temporary files, None for the system default; ignored by streamed output
+        self.compresslevel = None # zlib level (0-9) of the parts of streamed output, None for the default
+        self.deflate_threads = 1 # threads compressing the parts of the file, above 1 the file is streamed (see close);
+                                 # None or 0 for one per cpu
+        self.cache_dir = None # directory of saved files by content hash, see close; None to always build the file
 
         if parent is not None:
             self.parent = parent
@@ -858,92 +1091,314 @@ class Workbook():
         self.name = _os.path.basename(fpath)
         self.path=fpath
 
-    def close(self):
-        """
-        close a workbook without saving it
+    def close(self, fileobj=None, stream=False):
+        """
+        close a workbook, which is only then written to disk (or to fileobj)
+        :param fileobj: if given, the xlsx file is written to this file-like object instead of self.path; the parts of
+                        the file are then assembled in memory rather than in temporary files
+        :param stream: if True, each part of the file is compressed and written out as soon as it is serialized, so
+                       that output starts immediately and the finished archive is never held in memory; fileobj may
+                       then be any writable stream (eg a socket file or a pipe), seekable or not
+                       if self.deflate_threads is not 1, large parts are compressed in blocks by that many threads
+                       while the next ones are serialized, and the file is always streamed this way
+                       self.in_memory and self.tmpdir only apply to files which are not streamed
+                       with an xlsxwriter version lacking the hooks of _StreamWorkbook, the file is never streamed: it
+                       is built by xlsxwriter as usual, in memory and then copied to fileobj if given
+        if self.cache_dir is set, the file is looked up there by the hash of the content of the workbook first, and
+        only built (and added to the cache) if missing; it is then hard-linked (or copied) to self.path
         :return:
         """
+        if self.cache_dir is not None:
+            return self._close_cached(fileobj, stream)
+        if fileobj is None:
+            _unlink_cached(self.path)
         #create workbook
-        self.wb=XLW.Workbook(self.path,{'nan_inf_to_errors': True,'default_date_format': 'yyyy-mm-dd',})
+        options = {'nan_inf_to_errors': True, 'default_date_format': self.date_format,
+                   'in_memory': self.in_memory or fileobj is not None, 'tmpdir': self.tmpdir}
+        threads = _deflate_threads(self.deflate_threads)
+        target, copy_to = self.path if fileobj is None else fileobj, None
+        if (stream or threads > 1) and _STREAM_HOOKS:
+            self.wb=_StreamWorkbook(target, options, self.compresslevel, threads)
+        else:
+            if stream and fileobj is not None:
+                # fileobj may not be seekable, as xlsxwriter needs
+                target, copy_to = _io.BytesIO(), fileobj
+            self.wb=XLW.Workbook(target, options)
+        self._formats = {}
+        self._images = {}
         #create sheets
         for sheet in self.sheets:
             sheet.ws=self.wb.add_worksheet(sheet.name)
-            sheet.ws.outline_settings(outline_below=False,outline_right=False)
+            sheet.ws.outline_settings(symbols_below=False,symbols_right=False)
         # write all data to all sheets
         for sheet in self.sheets:
-            cells=list(set(sheet.cell_data.keys()).
-                       union(set(sheet.cell_formats.keys())).
-                       union(set(sheet.cell_options.keys()))
-                       )
-            rows=list(filter(lambda x: _isrow(x),cells))
-            for row in rows:
-                if row in sheet.cell_formats.keys():
-                    format = sheet.cell_formats[row]
-                    format = self.wb.add_format(format)
-                else:
-                    format=None
-                if row in sheet.cell_options.keys():
-                    options= sheet.cell_options[row]
-                else:
-                    options={}
-                coords=_a2cr(row)
-                for r in range(coords[1],coords[3]+1):
-                    sheet.ws.set_row(r,None,cell_format=format,options=options)
-            cols=list(filter(lambda x: _iscol(x),cells))
-            for col in cols:
-                if col in sheet.cell_formats.keys():
-                    format = sheet.cell_formats[col]
-                    format = self.wb.add_format(format)
-                else:
-                    format=None
-                if col in sheet.cell_options.keys():
-                    options= sheet.cell_options[row]
-                else:
-                    options={}
-                coords=_a2cr(row)
-                for c in range(coords[0],coords[2]+1):
-                    sheet.ws.set_col(c,None,cell_format=format,options=options)
-            cells=list(set(cells)-set(rows)-set(cols))
-            for cell in cells:
-                if cell in sheet.cell_formats.keys():
-                    format=sheet.cell_formats[cell]
-                    format = self.wb.add_format(format)
-                else:
-                    format=None
-                if cell in sheet.cell_data.keys():
-                    value=sheet.cell_data[cell]
-
-                    if len(str(value))>0:
-
-                        if str(value)[0]=='=':
-                            sheet.ws.write_formula(cell, value, format)
-                        elif str(value)[0]== '{':
-                            sheet.ws.write_array_formula(cell, value, format)
-                        else:
-                            coords=_a2cr(cell)
-                            if len(coords)==2:
-                                coords=[coords[0],coords[1],coords[0],coords[1]]
-                            for c in range(coords[0],coords[2]+1):
-                                for r in range(coords[1],coords[3]+1):
-                                    sheet.ws.write(r - 1, c - 1, value, format)
+            self._write_sheet(sheet)
 
-                    else:
-                        coords=_a2cr(cell)
-                        if len(coords)==2:
-                            coords=[coords[0],coords[1],coords[0],coords[1]]
-                        for c in range(coords[0],coords[2]+1):
-                            for r in range(coords[1],coords[3]+1):
-                                sheet.ws.write(r - 1, c - 1, value, format)
+        self.parent.workbooks.remove(self)
+        self.wb.close()
+        if copy_to is not None:
+            copy_to.write(target.getvalue())
+
+    def close_async(self, fileobj=None, stream=False, max_pending=4):
+        """
+        close a workbook in the background: the workbook is closed at once for the caller, and a snapshot of its
+        content (see _snapshot) is written by a background thread, so that the caller may go on (eg fetching the data
+        of the next workbook) while the file is serialized and compressed
+        if max_pending saves are already queued or running, the call blocks until one of them completes, so that
+        snapshots do not pile up in memory when workbooks are produced faster than they are written
+
+        example:
+
+        futures = [build_report(x, client).close_async() for client in clients]
+        for f in futures:
+            print(f.result()) # SaveResult(path='...', seconds=...)
+
+        :param fileobj: see close; it must not be used until the save completes
+        :param stream: see close
+        :param max_pending: maximum number of saves queued or running in the background
+        :return: concurrent.futures.Future of SaveResult(path, seconds), path being fileobj if given; exceptions of
+                 close are raised by its result()
+        """
+        global _pending_saves
+        with _saves_done:
+            _saves_done.wait_for(lambda: _pending_saves < max_pending)
+            _pending_saves += 1
+        try:
+            snapshot = self._snapshot()
+            future = _save_pool().submit(_close_snapshot, snapshot, fileobj, stream)
+        except BaseException:
+            _save_done(None)
+            raise
+        future.add_done_callback(_save_done)
+        self.parent.workbooks.remove(self)
+        return future
+
+    def _snapshot(self):
+        """
+        copy-on-write view of the workbook as it is now, closed by close_async while the original may change: only the
+        containers of each sheet that later writes modify are copied, one level deep for the per cell format and
+        option dicts; their values (data blocks, outline arrays, charts, tables...) are shared, as writes replace
+        rather than modify them, and data blocks hold copies of the DataFrames they come from (see _df_to_cols), so
+        that the caller may change its frames at once. Image files are read when the copy is closed, so they must not
+        change until then
+        :return: Workbook, belonging to a new Excel object
+        """
+        wb = _copy(self)
+        wb.parent = Excel()
+        wb.parent.workbooks.append(wb)
+        wb.sheets = []
+        for sheet in self.sheets:
+            new = _copy(sheet)
+            for k in _SHEET_STATE:
+                v = getattr(sheet, k)
+                if k in ('cell_formats', 'cell_options'):
+                    v = {addr: dict(x) if isinstance(x, dict) else x for addr, x in v.items()}
+                elif isinstance(v, (dict, list)):
+                    v = _copy(v)
+                setattr(new, k, v)
+            new.workbook = wb
+            new.rng = Rng('A1', sheet=new)
+            wb.sheets.append(new)
+        return wb
+
+    def compile(self):
+        """
+        record the current layout and content of the workbook as a template, from which new workbooks are created with
+        Template.stamp
+        :return: Template
+        """
+        return Template(self)
+
+    def content_hash(self):
+        """
+        hash of everything written to the file: the stored content of all sheets, with images read from their source,
+        the settings of the workbook affecting the output, the engine and the xlsxwriter version
+        :return: hex digest
+        """
+        h = _hashlib.sha1()
+        _hash_update(h, [type(self).__module__, type(self).__name__, XLW.__version__, self.date_format,
+                         self.compresslevel])
+        for sheet in self.sheets:
+            _hash_update(h, [sheet.name] + [getattr(sheet, k) for k in _SHEET_STATE if k != 'images'])
+            _hash_update(h, {addr: (_image_data(figpath), w, h_) for addr, (figpath, w, h_) in sheet.images.items()})
+        return h.hexdigest()
 
+    def _close_cached(self, fileobj=None, stream=False):
+        """
+        close a workbook through the cache in self.cache_dir, see close
+        files are added to the cache under a temporary name and then renamed, so that concurrent processes sharing the
+        cache never see partial files
+        :param fileobj: see close
+        :param stream: see close
+        :return:
+        """
+        cache_dir, path = self.cache_dir, self.path
+        cached = _os.path.join(cache_dir, self.content_hash() + '.xlsx')
+        if _os.path.exists(cached):
+            self.parent.workbooks.remove(self)
+        else:
+            _os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = _tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+            _os.close(fd)
+            self.cache_dir, self.path = None, tmp
+            try:
+                self.close(stream=stream)
+                _os.replace(tmp, cached)
+            finally:
+                self.cache_dir, self.path = cache_dir, path
+                if _os.path.exists(tmp):
+                    _os.remove(tmp)
+        if fileobj is not None:
+            with open(cached, 'rb') as f:
+                _shutil.copyfileobj(f, fileobj)
+            return
+        if _os.path.lexists(path):
+            _os.remove(path)
+        try:
+            _os.link(cached, path)
+        except OSError:
+            _shutil.copyfile(cached, path)
+        else:
+            st = _os.stat(path)
+            _cache_links[_os.path.abspath(path)] = st.st_dev, st.st_ino
 
-                else:
-                    sheet.ws.write_blank(cell, None, format)
-            for addr, figpath in sheet.images.items():
-                c, r = _a2cr(addr)
-                sheet.ws.insert_image(r, c, figpath)
+    def to_bytes(self):
+        """
+        close the workbook and return the content of the xlsx file, without writing anything to disk
+        :return: bytes
+        """
+        buf = _io.BytesIO()
+        self.close(fileobj=buf)
+        return buf.getvalue()
 
-        self.parent.workbooks.remove(self)
-        self.wb.close()
+    def _read_columns(self, sheet, c1, r1, c2, r2, typed=False):
+        """
+        values of a rectangle of cells of the file the workbook was opened from; new workbooks have none, see
+        excel_fastxml.Workbook._read_columns
+        :return: dict column -> (rows, values) arrays
+        """
+        return {}
+
+    def _get_format(self, fmt):
+        """
+        return the xlsxwriter format object for a format dictionary, identical dictionaries share the same object
+        :param fmt: dictionary of format properties, or its key as given by _fmt_key, or None
+        :return:
+        """
+        if not fmt:
+            return None
+        key = fmt if isinstance(fmt, tuple) else _fmt_key(fmt)
+        if key not in self._formats:
+            self._formats[key] = self.wb.add_format(fmt)
+        return self._formats[key]
+
+    def _write_sheet(self, sheet):
+        """
+        write the data, formats and options stored in a sheet onto its xlsxwriter worksheet
+        :param sheet:
+        :return:
+        """
+        ws = sheet.ws
+        # formats on entire rows, entire columns and cells, as keys
+        row_fmts, col_fmts, cell_fmts = sheet._resolve_formats()
+        row_opts, col_opts = {}, {}
+        for addr, opts in sheet.cell_options.items():
+            c1, r1, c2, r2 = _a2cr(addr, f4=True)
+            if _isrow(addr):
+                for r in range(r1, r2 + 1): row_opts[r] = opts
+            elif _iscol(addr):
+                for c in range(c1, c2 + 1): col_opts[c] = opts
+
+        rows = set(row_fmts) | set(row_opts) | set(sheet.row_heights)
+        for r in sorted(rows):
+            options = dict(sheet._outline_options(r), **row_opts.get(r, {}))
+            ws.set_row(r - 1, sheet.row_heights.get(r), self._get_format(row_fmts.get(r)), options)
+        runs = sheet.outline_runs
+        for i in _np.flatnonzero(runs['level'][:-1] > 0).tolist():
+            options = sheet._outline_options(int(runs['start'][i]))
+            for r in range(int(runs['start'][i]), int(runs['start'][i + 1])):
+                if r not in rows:
+                    ws.set_row(r - 1, None, None, options)
+        for c in sorted(set(col_fmts) | set(col_opts) | set(sheet.col_widths)):
+            ws.set_column(c - 1, c - 1, sheet.col_widths.get(c), self._get_format(col_fmts.get(c)), col_opts.get(c, {}))
+
+        # a cell format replaces the row/column format in excel, so the latter are merged into the former
+        merged = {}
+        for (r, c), key in cell_fmts.items():
+            key = (col_fmts.get(c, ()), row_fmts.get(r, ()), key)
+            if key not in merged:
+                merged[key] = self._get_format(dict(key[0] + key[1] + key[2]))
+            cell_fmts[(r, c)] = merged[key]
+            ws.write_blank(r - 1, c - 1, None, merged[key])
+
+        for addr, (hdr, cols, rows) in sheet.blocks.items():
+            c1, r1 = _a2cr(addr, f4=True)[:2]
+            for i, row in enumerate(hdr):
+                for j, v in enumerate(row):
+                    ws.write(r1 + i - 1, c1 + j - 1, v, cell_fmts.get((r1 + i, c1 + j)))
+            r1 += len(hdr)
+            for j, (col, idx) in enumerate(zip(cols, rows)):
+                # empty cells were dropped when the block was stored, idx holds the rows of the remaining values
+                idx = range(len(col)) if idx is None else idx.tolist()
+                if col.dtype.kind in 'mM':
+                    # written as serial numbers sharing one date format, unless the column has a number format
+                    fmt = dict(col_fmts.get(c1 + j, ()))
+                    default = self._get_format(dict(fmt, num_format=fmt.get('num_format', self.date_format)))
+                    for i, v in zip(idx, _dt64_to_serial(col, self.wb.date_1904).tolist()):
+                        ws.write_number(r1 + i - 1, c1 + j - 1, v, cell_fmts.get((r1 + i, c1 + j), default))
+                    continue
+                # datetimes get the default date format unless given one, which would hide the column format
+                default = self._get_format(col_fmts.get(c1 + j)) if col.dtype.kind == 'O' else None
+                for i, v in zip(idx, col.tolist()):
+                    ws.write(r1 + i - 1, c1 + j - 1, v, cell_fmts.get((r1 + i, c1 + j), default))
+
+        for cell, value in sheet.cell_data.items():
+            coords = _a2cr(cell, f4=True)
+            fmt = cell_fmts.get((coords[1], coords[0]))
+            if len(str(value)) > 0 and str(value)[0] == '=':
+                ws.write_formula(cell, value, fmt)
+            elif len(str(value)) > 0 and str(value)[0] == '{':
+                ws.write_array_formula(cell, value, fmt)
+            else:
+                for c in range(coords[0], coords[2] + 1):
+                    for r in range(coords[1], coords[3] + 1):
+                        ws.write(r - 1, c - 1, value, cell_fmts.get((r, c)))
+
+        for addr, (figpath, w, h) in sheet.images.items():
+            data = _image_data(figpath)
+            digest = _hashlib.sha1(data).hexdigest()
+            data = self._images.setdefault(digest, data)
+            options = {'image_data': _io.BytesIO(data)}
+            size = _image_size(data)
+            if size is not None:
+                pw, ph, dpi = size
+                options.update({'x_scale': w / (pw * 96. / dpi), 'y_scale': h / (ph * 96. / dpi)})
+            c, r = _a2cr(addr, f4=True)[:2]
+            ws.insert_image(r - 1, c - 1, digest, options)
+        for addr, value in sheet.merges:
+            c1, r1, c2, r2 = _a2cr(addr)
+            fmt = dict(col_fmts.get(c1, ()) + row_fmts.get(r1, ()), valign='top')
+            ws.merge_range(r1 - 1, c1 - 1, r2 - 1, c2 - 1, value, self._get_format(fmt))
+        for addr, options in sheet.tables:
+            ws.add_table(addr, options)
+        for options in sheet.sparklines:
+            locs = options['location'].tolist()
+            ws.add_sparkline(locs[0], dict(options, location=locs, range=options['range'].tolist()))
+        for addr, options in sheet.charts:
+            chart = self.wb.add_chart({'type': options['type'], 'subtype': options['subtype']} if options['subtype']
+                                      else {'type': options['type']})
+            for series in options['series']:
+                chart.add_series(series)
+            if options['title'] is not None:
+                chart.set_title({'name': options['title']})
+            chart.set_size(options['size'])
+            ws.insert_chart(addr, chart)
+        for addr, options in sheet.cond_formats:
+            if 'format' in options:
+                options = dict(options, format=self._get_format(options['format']))
+            ws.conditional_format(addr, options)
+        if sheet.panes is not None:
+            ws.freeze_panes(*sheet.panes)
 
     def get_sheet(self, name):
         """
@@ -980,6 +1435,19 @@ class Sheet():
         self.cell_formats = {}
         self.cell_options = {}
         self.images = {}
+        self.cond_formats = []
+        self.charts = []
+        self.sparklines = []
+        self.tables = []
+        self.merges = []
+        self.blocks = {}
+        self.col_widths = {}
+        self.row_heights = {}
+        self.panes = None # (row, column), 0-based, of the top left cell of the unfrozen pane, see Rng.freeze_panes
+        self._compiled = None # formats resolved by the template the sheet was stamped from, see Template
+        # outline runs: run i covers rows start[i] to start[i+1]-1, the last run extends to the end of the sheet
+        self.outline_runs = {'start': _np.array([1]), 'level': _np.array([0]),
+                             'hidden': _np.array([False]), 'collapsed': _np.array([False])}
 
         if workbook is None:
             self.workbook = Workbook(name='WB_'+name)
@@ -1011,6 +1479,174 @@ class Sheet():
         self.rng = Rng(address=address, row=row, col=col, sheet=self)
         return self.rng
 
+    def _store_block(self, address, hdr, cols, rows=None):
+        """
+        store a block of data, as returned by _df_to_cols, at the given address
+        cell values previously stored inside the address are dropped, as they would be overwritten anyway
+        :param address: address of the range covered by the block
+        :param hdr: list of header rows
+        :param cols: list of column arrays
+        :param rows: list of row arrays (0-based, below the header) of the values of each column, None for full columns
+        :return:
+        """
+        if rows is None: rows = [None] * len(cols)
+        c1, r1, c2, r2 = _a2cr(address, f4=True)
+        for addr in list(self.cell_data.keys()):
+            cc = _a2cr(addr, f4=True)
+            if cc[0] >= c1 and cc[1] >= r1 and cc[2] <= c2 and cc[3] <= r2:
+                del self.cell_data[addr]
+        self.blocks.pop(address, None)
+        self.blocks[address] = (hdr, cols, rows)
+
+    def _resolve_formats(self):
+        """
+        formats of the sheet on entire rows, entire columns and cells, see _resolve_formats; a sheet stamped from a
+        template starts from the formats resolved by the template, and only adds those set since, as long as the
+        formats of the template were not changed
+        :return: row_fmts, col_fmts, cell_fmts
+        """
+        items = list(self.cell_formats.items())
+        if self._compiled is not None:
+            fmts, resolved = self._compiled
+            if items[:len(fmts)] == fmts:
+                return _resolve_formats(items[len(fmts):], resolved)
+        return _resolve_formats(items)
+
+    def _get_values(self, c1, r1, c2, r2):
+        """
+        return the values stored in a rectangle of cells as a list of lists (rows), empty cells are None
+        :param c1: left column, 1-based
+        :param r1: top row, 1-based
+        :param c2: right column, 1-based
+        :param r2: bottom row, 1-based
+        :return:
+        """
+        out = [[None] * (c2 - c1 + 1) for _ in range(r2 - r1 + 1)]
+        for baddr, (hdr, cols, rows) in self.blocks.items():
+            bc1, br1, bc2, br2 = _a2cr(baddr, f4=True)
+            for r in range(max(r1, br1), min(r2, br2) + 1):
+                for c in range(max(c1, bc1), min(c2, bc2) + 1):
+                    if r - br1 < len(hdr):
+                        out[r - r1][c - c1] = hdr[r - br1][c - bc1]
+                    else:
+                        out[r - r1][c - c1] = _col_value(cols[c - bc1], rows[c - bc1], r - br1 - len(hdr))
+        for addr, v in self.cell_data.items():
+            c, r = _a2cr(addr, f4=True)[:2]
+            if c1 <= c <= c2 and r1 <= r <= r2:
+                out[r - r1][c - c1] = v
+        return out
+
+    def _set_outline(self, r1, r2, level):
+        """
+        raise the outline level of rows r1 to r2 to at least level; rows at level 2 are hidden, rows above level 2 are
+        collapsed
+        all groups are merged into the existing runs in a single pass over the union of their boundaries
+        :param r1: first row (or array of first rows), 1-based
+        :param r2: last row (or array of last rows), 1-based
+        :param level: outline level (or array of levels)
+        :return:
+        """
+        r1, r2, level = [_np.atleast_1d(_np.asarray(x, dtype=int)) for x in (r1, r2, level)]
+        level = _np.broadcast_to(level, r1.shape)
+        runs = self.outline_runs
+        start = _np.unique(_np.concatenate([runs['start'], r1, r2 + 1]))
+        old = _np.searchsorted(runs['start'], start, side='right') - 1
+        new = {k: runs[k][old] for k in ('level', 'hidden', 'collapsed')}
+        touched = _np.zeros(len(start), dtype=bool)
+        for lvl in _np.unique(level).tolist():
+            m = level == lvl
+            cover = _np.zeros(len(start) + 1, dtype=int)
+            _np.add.at(cover, _np.searchsorted(start, r1[m]), 1)
+            _np.add.at(cover, _np.searchsorted(start, r2[m] + 1), -1)
+            covered = _np.cumsum(cover)[:-1] > 0
+            new['level'][covered] = _np.maximum(new['level'][covered], lvl)
+            touched |= covered
+        new['hidden'] |= touched & (new['level'] == 2)
+        new['collapsed'] |= touched & (new['level'] > 2)
+        # merge consecutive runs with identical attributes
+        keep = _np.zeros(len(start), dtype=bool)
+        keep[0] = True
+        for k in new:
+            keep[1:] |= new[k][1:] != new[k][:-1]
+        runs['start'] = start[keep]
+        for k in new:
+            runs[k] = new[k][keep]
+
+    def _outline_options(self, r):
+        """
+        return the outline options of row r, as expected by xlsxwriter set_row
+        :param r: row, 1-based
+        :return: dict
+        """
+        runs = self.outline_runs
+        i = _np.searchsorted(runs['start'], r, side='right') - 1
+        return {'level': int(runs['level'][i]), 'hidden': bool(runs['hidden'][i]),
+                'collapsed': bool(runs['collapsed'][i])}
+
+    def _get_column(self, c, r1, r2):
+        """
+        return the data stored in column c between rows r1 and r2 as a list of (first row, array) pieces, one for each
+        block and header crossing the column, plus one for any single cell values
+        :param c: column, 1-based
+        :param r1: top row, 1-based
+        :param r2: bottom row, 1-based
+        :return:
+        """
+        out = []
+        for baddr, (hdr, cols, rows) in self.blocks.items():
+            bc1, br1, bc2, br2 = _a2cr(baddr, f4=True)
+            if not bc1 <= c <= bc2:
+                continue
+            col = _densify(cols[c - bc1], rows[c - bc1], br2 - br1 + 1 - len(hdr))
+            pieces = [(br1, _np.array([row[c - bc1] for row in hdr], dtype=object)), (br1 + len(hdr), col)]
+            for top, arr in pieces:
+                lo, hi = max(r1, top), min(r2, top + len(arr) - 1)
+                if lo <= hi:
+                    out.append((lo, arr[lo - top:hi - top + 1]))
+        for addr, v in self.cell_data.items():
+            cc, r = _a2cr(addr, f4=True)[:2]
+            if cc == c and r1 <= r <= r2:
+                out.append((r, _np.array([v], dtype=object)))
+        return out
+
+    def _get_columns(self, c1, r1, c2, r2, typed=False, trim=False):
+        """
+        return the values of a rectangle of cells as arrays, one per column: those of the file the workbook was opened
+        from, if any (see Workbook._read_columns), replaced by the data stored in the sheet
+        :param c1: left column, 1-based
+        :param r1: top row, 1-based
+        :param c2: right column, 1-based
+        :param r2: bottom row, 1-based
+        :param typed: if True, columns of the file only holding numbers (or dates) are float (or datetime64) arrays,
+                      NaN (or NaT) for empty cells; otherwise all arrays hold python objects, None for empty cells
+        :param trim: if True, the rectangle is cut at the last row and column holding a value
+        :return: list of arrays
+        """
+        read = self.workbook._read_columns(self, c1, r1, c2, r2, typed)
+        if trim:
+            c_last = r_last = 0
+            for addr in list(self.blocks) + list(self.cell_data):
+                c, r = _a2cr(addr, f4=True)[2:]
+                c_last, r_last = max(c_last, c), max(r_last, r)
+            for c, (rows, values) in read.items():
+                c_last, r_last = max(c_last, c), max(r_last, rows[-1])
+            c2, r2 = min(c2, c_last), min(r2, r_last)
+        n = max(0, r2 - r1 + 1)
+        out = []
+        for c in range(c1, c2 + 1):
+            rows, values = read.get(c, (_np.zeros(0, dtype=_np.int64), _np.zeros(0, dtype=object)))
+            stored = self._get_column(c, r1, r2)
+            if typed and not stored and values.dtype.kind in 'fM':
+                col = _np.full(n, _np.nan if values.dtype.kind == 'f' else values.dtype.type('NaT'), dtype=values.dtype)
+                col[rows - r1] = values
+            else:
+                col = _np.full(n, None, dtype=object)
+                col[rows - r1] = _to_objects(values)
+                for top, arr in stored:
+                    col[top - r1:top - r1 + len(arr)] = _to_objects(arr)
+            out.append(col)
+        return out
+
     def rename(self, name):
         """
         change the name of the current sheet
@@ -1098,7 +1734,292 @@ class Sheet():
 
 
 def _rgb2xlcol(rgb):
-    return '#%02x%02x%02x' % tuple([255,0,0])
+    return '#%02x%02x%02x' % tuple(rgb)
+
+def _fmt_key(fmt):
+    """
+    hashable key of a format dictionary, identical formats having the same key
+    :param fmt: dict or None
+    :return: tuple of sorted (property, value) pairs
+    """
+    return tuple(sorted(fmt.items())) if fmt else ()
+
+def _resolve_formats(items, start=None):
+    """
+    resolve formats set on entire rows, entire columns and ranges of cells, later formats adding properties to earlier
+    ones; formats are interned as keys (see _fmt_key), so that each combination of formats is merged only once
+    :param items: list of (address, format dict), in the order they were set
+    :param start: (row_fmts, col_fmts, cell_fmts) the formats are added to, eg those resolved by a template; they are
+                  not modified
+    :return: row_fmts, col_fmts, cell_fmts: dicts row -> key, column -> key and (row, column) -> key
+    """
+    row_fmts, col_fmts, cell_fmts = ({}, {}, {}) if start is None else tuple(dict(d) for d in start)
+    memo = {}
+    for addr, fmt in items:
+        c1, r1, c2, r2 = _a2cr(addr, f4=True)
+        if _isrow(addr):
+            target, keys = row_fmts, range(r1, r2 + 1)
+        elif _iscol(addr):
+            target, keys = col_fmts, range(c1, c2 + 1)
+        else:
+            target, keys = cell_fmts, [(r, c) for r in range(r1, r2 + 1) for c in range(c1, c2 + 1)]
+        new = _fmt_key(fmt)
+        for k in keys:
+            old = target.get(k, ())
+            if (old, new) not in memo:
+                memo[old, new] = _fmt_key(dict(old + new))
+            target[k] = memo[old, new]
+    return row_fmts, col_fmts, cell_fmts
+
+# attributes of a sheet holding its content, copied by templates
+_SHEET_STATE = ('cell_data', 'cell_formats', 'cell_options', 'images', 'cond_formats', 'charts', 'sparklines',
+                'tables', 'merges', 'blocks', 'col_widths', 'row_heights', 'outline_runs', 'panes')
+
+class Template():
+    """
+    compiled layout of a workbook, as recorded by Workbook.compile: the content of its sheets (headers, static cells,
+    formats, column widths, panes, outlines, data...) and its settings are frozen, and the formats of each sheet are
+    resolved once; stamp creates new workbooks from it, to which only the variable data is then written
+
+    example:
+
+    wb = x.create_wb()
+    sh = wb.sheets[0]
+    sh.arng('A1').value('Monthly report')
+    sh.arng('A1').font_format(bold=True, size=14)
+    sh.arng('A:A').column_width(30)
+    sh.arng('B4').freeze_panes()
+    tpl = wb.compile()
+
+    for client, df in frames.items():
+        wb = tpl.stamp(client + '.xlsx')
+        wb.sheets[0].arng('A3').from_pandas(df)
+        wb.close()
+    """
+
+    def __repr__(self):
+        return "Template of %s workbooks, has %i sheets" % (self.engine.__module__, len(self.sheets))
+
+    def __init__(self, wb):
+        self.engine = type(wb)
+        # settings of the workbook (date_format, precision, compresslevel...), but not its name or file
+        self.settings = {k: v for k, v in vars(wb).items()
+                         if not k.startswith('_') and k not in ('name', 'path', 'wb', 'parent', 'sheets')}
+        self.sheets = []
+        for sheet in wb.sheets:
+            state = {k: getattr(sheet, k) for k in _SHEET_STATE if k != 'blocks'}
+            # figures are rendered now, as they may change afterwards
+            state['images'] = {addr: (_image_data(figpath), w, h) for addr, (figpath, w, h) in state['images'].items()}
+            state = dict(_deepcopy(state), blocks=dict(sheet.blocks))
+            self.sheets.append((sheet.name, state, (list(state['cell_formats'].items()), sheet._resolve_formats())))
+
+    def stamp(self, name='Workbook.xlsx', parent=None):
+        """
+        create a new workbook from the template
+        the sheets start with copies of the content of the template, data blocks being shared (they are replaced, not
+        modified, by later writes), and the formats resolved by the template are reused when the workbook is closed
+        :param name: name (path) of the new workbook
+        :param parent: Excel object, None for a new one
+        :return: Workbook
+        """
+        wb = self.engine(parent=parent, name=name)
+        for k, v in self.settings.items():
+            setattr(wb, k, _copy(v))
+        wb.sheets = []
+        for sname, state, compiled in self.sheets:
+            sheet = wb.create_sheet(sname)
+            for k, v in state.items():
+                setattr(sheet, k, dict(v) if k == 'blocks' else _deepcopy(v))
+            sheet._compiled = compiled
+        return wb
+
+_pool = None
+
+def _render_pool():
+    """
+    thread pool shared by all workbooks, used to render figures while the rest of the workbook is built
+    it has a single worker, as matplotlib is not thread safe and concurrent renders may produce corrupted images
+    :return:
+    """
+    global _pool
+    if _pool is None:
+        _pool = _futures.ThreadPoolExecutor(max_workers=1)
+    return _pool
+
+def _reset_pools():
+    """
+    forget the thread pools in a forked child process, where their threads do not exist
+    :return:
+    """
+    global _pool, _save_executor, _pending_saves, _saves_done
+    _pool = None
+    _deflate_pools.clear()
+    _save_executor, _pending_saves, _saves_done = None, 0, _threading.Condition()
+
+_save_executor = None
+_pending_saves = 0 # saves queued or running, see Workbook.close_async
+_saves_done = _threading.Condition() # notified as saves complete
+
+SaveResult = _collections.namedtuple('SaveResult', ['path', 'seconds'])
+
+def _save_pool():
+    """
+    thread pool shared by all workbooks, closing workbooks in the background for Workbook.close_async
+    it has a single worker, saves being written one at a time in the order they were made: the serialization of a
+    workbook is already spread over threads (compression) or processes (fastxml workers) where it pays off
+    :return:
+    """
+    global _save_executor
+    if _save_executor is None:
+        _save_executor = _futures.ThreadPoolExecutor(max_workers=1)
+    return _save_executor
+
+def _close_snapshot(wb, fileobj=None, stream=False):
+    """
+    close a snapshot of a workbook, in the thread of _save_pool
+    :param wb: Workbook from Workbook._snapshot
+    :param fileobj: see Workbook.close
+    :param stream: see Workbook.close
+    :return: SaveResult
+    """
+    start = _time.perf_counter()
+    wb.close(fileobj=fileobj, stream=stream)
+    return SaveResult(wb.path if fileobj is None else fileobj, _time.perf_counter() - start)
+
+def _save_done(future):
+    """
+    release the slot of a completed save, see Workbook.close_async
+    :param future:
+    :return:
+    """
+    global _pending_saves
+    with _saves_done:
+        _pending_saves -= 1
+        _saves_done.notify_all()
+
+if hasattr(_os, 'register_at_fork'):
+    _os.register_at_fork(after_in_child=_reset_pools)
+
+def _render_fig(fig):
+    """
+    render a matplotlib figure to png
+    :param fig:
+    :return: bytes
+    """
+    buf = _io.BytesIO()
+    fig.savefig(buf, format='png', dpi=fig.dpi)
+    return buf.getvalue()
+
+def _image_data(figpath):
+    """
+    content of an image stored by paste_fig
+    :param figpath: path of the file, bytes or Future of the rendering of a figure
+    :return: bytes
+    """
+    if isinstance(figpath, _futures.Future):
+        return figpath.result()
+    if isinstance(figpath, bytes):
+        return figpath
+    with open(figpath, 'rb') as f:
+        return f.read()
+
+_cache_links = {} # absolute path -> (st_dev, st_ino) of the files hard linked by Workbook.close to its cache
+
+def _unlink_cached(path):
+    """
+    remove a file about to be written if it is still a hard link made by Workbook.close to its cache, so that writing
+    it does not modify the cached file as well; other files are left alone, even with several links
+    :param path:
+    :return:
+    """
+    try:
+        path = _os.path.abspath(path)
+        st = _os.stat(path)
+        if st.st_nlink > 1 and _cache_links.pop(path, None) == (st.st_dev, st.st_ino):
+            _os.remove(path)
+    except (OSError, TypeError):
+        pass
+
+def _image_size(data):
+    """
+    read width, height (in pixels) and resolution (dpi) from the header of a png or jpeg image
+    :param data: bytes
+    :return: width, height, dpi or None if the format is not recognized
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        w, h = _struct.unpack('>II', data[16:24])
+        dpi, i = 96., 8
+        while i < len(data):
+            n, kind = _struct.unpack('>I4s', data[i:i + 8])
+            if kind == b'pHYs':
+                x, y, unit = _struct.unpack('>IIB', data[i + 8:i + 17])
+                if unit == 1 and x > 0: dpi = x * 0.0254
+            elif kind == b'IDAT':
+                break
+            i += n + 12
+        return w, h, dpi
+    if data[:2] == b'\xff\xd8':
+        dpi, i = 96., 2
+        while i + 4 <= len(data):
+            marker, n = _struct.unpack('>HH', data[i:i + 4])
+            if marker == 0xFFE0 and data[i + 4:i + 9] == b'JFIF\x00':
+                unit, x = _struct.unpack('>BH', data[i + 11:i + 14])
+                if unit == 1 and x > 0: dpi = float(x)
+                elif unit == 2 and x > 0: dpi = x * 2.54
+            elif 0xFFC0 <= marker <= 0xFFCF and marker not in (0xFFC4, 0xFFC8, 0xFFCC):
+                h, w = _struct.unpack('>HH', data[i + 5:i + 9])
+                return w, h, dpi
+            i += n + 2
+    return None
+
+def _estimate_width(arr, fmt=None, budget=10000):
+    """
+    estimate the number of characters needed to display an array of values
+    :param arr: numpy array
+    :param fmt: excel number format applied to the values, if any
+    :param budget: maximum number of text values measured, larger arrays are measured on a stratified sample
+    :return: number of characters
+    """
+    if len(arr) == 0:
+        return 0
+    if arr.dtype.kind == 'b':
+        return 5
+    if arr.dtype.kind in 'iuf':
+        vals = arr[_np.isfinite(arr)] if arr.dtype.kind == 'f' else arr
+        if len(vals) == 0:
+            return 0
+        vmax = float(_np.max(_np.abs(vals)))
+        if fmt is not None and '%' in fmt:
+            vmax *= 100
+        digits = int(_np.floor(_np.log10(vmax))) + 1 if vmax >= 1 else 1
+        sign = 1 if _np.min(vals) < 0 else 0
+        if fmt is None or fmt.lower() == 'general':
+            if arr.dtype.kind == 'f' and not _np.all(_np.mod(vals, 1) == 0):
+                return min(digits + sign + 9, 11)
+            return min(digits + sign, 11)
+        if fmt == '@':
+            return digits + sign
+        section = fmt.split(';')[0]
+        decimals = len(_re.findall('[0#?]', section.split('.')[1])) if '.' in section else 0
+        commas = (digits - 1) // 3 if ',' in section.split('.')[0] else 0
+        return digits + sign + commas + decimals + (1 if decimals else 0) + section.count('%')
+    if len(arr) > budget:
+        # one random row in each of budget equally sized strata
+        strata = (_np.arange(budget) + _np.random.random(budget)) * (len(arr) / budget)
+        arr = arr[strata.astype(int)]
+    if arr.dtype.kind in 'mM':
+        if _np.all(_np.isnat(arr)):
+            return 0
+        return len(fmt) if fmt is not None else 10
+    temp = _pd.Series(arr, dtype=object).dropna()
+    if len(temp) == 0:
+        return 0
+    if _pd.api.types.infer_dtype(temp) in ('datetime', 'datetime64', 'date'):
+        return len(fmt) if fmt is not None else 10
+    temp = temp.astype(str)
+    if temp.str.contains('\n', regex=False).any():
+        temp = temp.str.split('\n').explode()
+    return int(temp.str.len().max())
 
 def _get_contiguous(address, cells):
 
@@ -1130,3 +2051,284 @@ def _is_contiguous(a,b):
 
 def _expand_range(a,b):
     return [min(a[0],b[0]),min(a[1],b[1]),max(a[2],b[2]),max(a[3],b[3])]
+
+def _zipinfo(name, compresslevel=None):
+    """
+    zip entry for a part of an xlsx file, with a fixed timestamp as xlsxwriter does, so that identical workbooks give
+    identical files
+    :param name: name of the part, eg xl/workbook.xml
+    :param compresslevel: zlib level, None for the default
+    :return: ZipInfo
+    """
+    info = _zipfile.ZipInfo(name, (1980, 1, 1, 0, 0, 0))
+    info.compress_type = _zipfile.ZIP_DEFLATED
+    # the level is not taken from the archive when a ZipInfo is given; the attribute is only public since python 3.13
+    for attr in ('compress_level', '_compresslevel'):
+        if attr in _zipfile.ZipInfo.__slots__:
+            setattr(info, attr, compresslevel)
+            break
+    return info
+
+def _zip_level(info):
+    """
+    zlib level of a ZipInfo from _zipinfo
+    :param info:
+    :return:
+    """
+    return getattr(info, 'compress_level', getattr(info, '_compresslevel', None))
+
+# zipfile internals through which compressed data is written (or read) directly, present from python 3.6 to 3.13
+_ZIP_WRITE_ATTRS = ('_lock', 'fp', 'start_dir', '_didModify', 'filelist', 'NameToInfo')
+_ZIP_READ_ATTRS = ('_lock', 'fp')
+
+def _raw_zip(zf, attrs=_ZIP_WRITE_ATTRS):
+    """
+    True if compressed data can be written to (or read from) a ZipFile directly, through the zipfile internals in
+    attrs; otherwise the public interface is used, decompressing or recompressing the data
+    :param zf: ZipFile
+    :param attrs: _ZIP_WRITE_ATTRS or _ZIP_READ_ATTRS
+    :return:
+    """
+    return hasattr(_zipfile.ZipInfo, 'FileHeader') and all(hasattr(zf, a) for a in attrs)
+
+_DEFLATE_BLOCK = 2**20 # size of the blocks of uncompressed data deflated in parallel
+
+def _deflate_threads(threads=None):
+    """
+    number of threads compressing zip entries
+    :param threads: None or 0 for one per cpu
+    :return:
+    """
+    return threads or _os.cpu_count() or 1
+
+_deflate_pools = {}
+
+def _deflate_pool(threads):
+    """
+    thread pool shared by all workbooks compressing blocks of zip entries, one per number of threads
+    :param threads:
+    :return:
+    """
+    if threads not in _deflate_pools:
+        _deflate_pools[threads] = _futures.ThreadPoolExecutor(max_workers=threads)
+    return _deflate_pools[threads]
+
+def _deflate_block(data, level, zdict, last):
+    """
+    compress a block of a zip entry, see _ParallelDeflate
+    :param data: bytes
+    :param level: zlib level
+    :param zdict: last 32KB of the previous block, or empty
+    :param last: True for the last block of the entry
+    :return: raw deflate data
+    """
+    if zdict:
+        co = _zlib.compressobj(level, _zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        co = _zlib.compressobj(level, _zlib.DEFLATED, -15)
+    return co.compress(data) + co.flush(_zlib.Z_FINISH if last else _zlib.Z_SYNC_FLUSH)
+
+class _ParallelDeflate():
+    """
+    compressor with the interface of zlib compression objects, producing a raw deflate stream from blocks compressed
+    independently by a pool of threads (zlib releases the GIL), as pigz does: each block is primed with the last 32KB
+    of the previous one and flushed to a byte boundary, so that the compressed blocks can simply be concatenated
+    compressed data is returned in order as soon as it is ready; no more than two blocks per thread are pending at a
+    time, further writes waiting for the oldest
+    """
+    def __init__(self, level=None, threads=None, block=_DEFLATE_BLOCK):
+        self._level = _zlib.Z_DEFAULT_COMPRESSION if level is None else level
+        self._threads = _deflate_threads(threads)
+        self._block = block
+        self._buf = []
+        self._size = 0
+        self._tail = b''
+        self._pending = _collections.deque()
+
+    def _submit(self, data, last):
+        self._pending.append(_deflate_pool(self._threads).submit(_deflate_block, data, self._level, self._tail, last))
+        self._tail = data[-2**15:]
+
+    def compress(self, data):
+        self._buf.append(data)
+        self._size += len(data)
+        if self._size >= self._block:
+            data, n = b''.join(self._buf), self._size - self._size % self._block
+            for i in range(0, n, self._block):
+                self._submit(data[i:i + self._block], False)
+            self._buf, self._size = [data[n:]], len(data) - n
+        out = []
+        while self._pending and (len(self._pending) > 2 * self._threads or self._pending[0].done()):
+            out.append(self._pending.popleft().result())
+        return b''.join(out)
+
+    def flush(self, mode=_zlib.Z_FINISH):
+        data = b''.join(self._buf)
+        self._buf, self._size = [], 0
+        if not self._pending:
+            # small entries are compressed at once
+            return _deflate_block(data, self._level, self._tail, True)
+        self._submit(data, True)
+        out = [f.result() for f in self._pending]
+        self._pending.clear()
+        return b''.join(out)
+
+def _open_entry(zf, info, threads=None, force_zip64=False):
+    """
+    open a deflated zip entry for writing, its data being compressed in parallel by _ParallelDeflate
+    :param zf: ZipFile open for writing
+    :param info: ZipInfo from _zipinfo
+    :param threads: number of threads, None for one per cpu, 1 to compress in the calling thread as zipfile does
+    :param force_zip64: see ZipFile.open
+    :return: writable file object
+    """
+    fh = zf.open(info, 'w', force_zip64=force_zip64)
+    threads = _deflate_threads(threads)
+    # the compressor is replaced where zipfile keeps it (python 3.6 to 3.13), otherwise zipfile compresses the entry
+    if threads > 1 and getattr(fh, '_compressor', None) is not None:
+        fh._compressor = _ParallelDeflate(_zip_level(info), threads)
+    return fh
+
+def _write_deflated(zf, info, data, crc, size):
+    """
+    add an entry already compressed with raw deflate to a zip archive open for writing, without decompressing it
+    :param zf: ZipFile
+    :param info: ZipInfo of the entry, with deflate compression
+    :param data: compressed data
+    :param crc: crc32 of the uncompressed data
+    :param size: size of the uncompressed data
+    :return:
+    """
+    if not _raw_zip(zf):
+        zf.writestr(info, _zlib.decompress(data, -15))
+        return
+    with zf._lock:
+        info.CRC, info.compress_size, info.file_size = crc, len(data), size
+        info.header_offset = zf.fp.tell()
+        zf.fp.write(info.FileHeader())
+        zf.fp.write(data)
+        zf.filelist.append(info)
+        zf.NameToInfo[info.filename] = info
+        zf.start_dir = zf.fp.tell()
+
+_COPY_CHUNK = 2**20 # size of the chunks of compressed data copied between archives by _copy_entry
+
+def _copy_entry(zf, src, info):
+    """
+    copy an entry of a zip archive to another one open for writing as it is stored, without decompressing and
+    recompressing it
+    :param zf: ZipFile open for writing
+    :param src: ZipFile open for reading
+    :param info: ZipInfo of the entry in src
+    :return:
+    """
+    new = _copy(info)
+    new.flag_bits &= ~0x08 # sizes and crc are known, no data descriptor follows the data
+    new.extra = b'' # zip64 fields are rebuilt as needed by FileHeader
+    if not (_raw_zip(zf) and _raw_zip(src, _ZIP_READ_ATTRS)):
+        with src.open(info) as fi, zf.open(new, 'w', force_zip64=info.file_size > _zipfile.ZIP64_LIMIT) as fo:
+            _shutil.copyfileobj(fi, fo, _COPY_CHUNK)
+        return
+    with src._lock, zf._lock:
+        src.fp.seek(info.header_offset)
+        header = src.fp.read(_zipfile.sizeFileHeader)
+        if header[:4] != _zipfile.stringFileHeader:
+            raise _zipfile.BadZipFile("bad local file header of %s" % info.filename)
+        name_len, extra_len = _struct.unpack('<HH', header[26:30])
+        src.fp.seek(name_len + extra_len, 1)
+        new.header_offset = zf.fp.tell()
+        zf.fp.write(new.FileHeader())
+        left = info.compress_size
+        while left:
+            data = src.fp.read(min(left, _COPY_CHUNK))
+            if not data:
+                raise EOFError("truncated entry %s" % info.filename)
+            zf.fp.write(data)
+            left -= len(data)
+        zf.filelist.append(new)
+        zf.NameToInfo[new.filename] = new
+        zf.start_dir = zf.fp.tell()
+        zf._didModify = True
+
+class _ZipTextEntry(_io.StringIO):
+    """
+    text file handle given to the xlsxwriter xml writers by _StreamPackager: the xml is encoded and compressed into a
+    zip entry as it is written, in chunks of about 64KB, instead of being kept in memory
+    """
+    def __init__(self, fh):
+        super().__init__()
+        self._fh = fh
+        self._buf = []
+        self._size = 0
+
+    def write(self, s):
+        self._buf.append(s)
+        self._size += len(s)
+        if self._size > 1 << 16:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+        if self._buf:
+            self._fh.write(''.join(self._buf).encode('utf-8'))
+            self._buf, self._size = [], 0
+
+    def close_entry(self):
+        self.flush()
+        self._fh.close()
+
+class _StreamPackager(_Packager):
+    """
+    xlsxwriter packager writing each part of the xlsx file into a zip archive on a stream as soon as it is serialized,
+    rather than collecting all parts first; non-seekable streams are supported, the sizes of the entries being written
+    in data descriptors after their data
+    """
+    def __init__(self, stream, compresslevel=None, zip64=False, threads=None):
+        super().__init__()
+        self._zip = _zipfile.ZipFile(stream, 'w', compression=_zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._zip64 = zip64
+        self._threads = threads
+        self._entry = None
+        self._done = 0
+
+    def _flush(self):
+        # finish the current text part, then copy the binary parts (images, vba) queued by the base class since
+        if self._entry is not None:
+            self._entry.close_entry()
+            self._entry = None
+        for data, name, is_binary in self.filenames[self._done:]:
+            self._zip.writestr(_zipinfo(name, self._zip.compresslevel),
+                               data.getvalue() if is_binary else data.getvalue().encode('utf-8'))
+        self._done = len(self.filenames)
+
+    def _filename(self, xml_filename):
+        self._flush()
+        info = _zipinfo(xml_filename, self._zip.compresslevel)
+        self._entry = _ZipTextEntry(_open_entry(self._zip, info, self._threads, force_zip64=self._zip64))
+        return self._entry
+
+    def _create_package(self):
+        super()._create_package()
+        self._flush()
+        self._zip.close()
+        # nothing is left for the workbook to add to its own (dummy) zip file
+        return []
+
+# private xlsxwriter hooks overridden by _StreamWorkbook and _StreamPackager, present in xlsxwriter 1.0 to 3.2; without
+# them, Workbook.close falls back to plain xlsxwriter workbooks
+_STREAM_HOOKS = hasattr(XLW.Workbook, '_get_packager') and hasattr(_Packager, '_filename') and \
+    hasattr(_Packager, '_create_package') and hasattr(_Packager(), 'filenames')
+
+class _StreamWorkbook(XLW.Workbook):
+    """
+    xlsxwriter workbook whose xlsx file is streamed to a file-like object (or a path) by a _StreamPackager
+    """
+    def __init__(self, target, options=None, compresslevel=None, threads=None):
+        # the base class writes an empty archive to its own file, which is discarded
+        super().__init__(_io.BytesIO(), dict(options or {}, in_memory=True))
+        self._target = target
+        self._compresslevel = compresslevel
+        self._threads = threads
+
+    def _get_packager(self):
+        return _StreamPackager(self._target, self._compresslevel, self.allow_zip64, self._threads)